@@ -5,15 +5,58 @@
     # Experimento variando o buffer 
         # python ex02.py --sweep 1,2,4,8,16,32 -P 4 -C 4 -d 15 --pmin 1 --pmax 5 --cmin 1 --cmax 5
 
+    # Buffer em anel pré-alocado (head/tail, caminho rápido SPSC) vs semáforos+lock, sem sleeps
+        # python ex02.py --impl ring -P 1 -C 1 -d 5 --pmin 0 --pmax 0 --cmin 0 --cmax 0
+        # python ex02.py --sweep 1,2,4,8,16,32 --impl sem,ring,mpmc -P 1 -C 1 -d 3 --pmin 0 --pmax 0 --cmin 0 --cmax 0
+
+    # Lotes: put_many/get_many movem até N itens por aquisição da trava
+        # python ex02.py -b 32 -P 4 -C 4 -d 5 --batch 8 --pmin 0 --pmax 1 --cmin 0 --cmax 1
+
+    # Encerramento: drain (consome o que sobrou) ou abort (descarta); latência e itens não drenados
+        # python ex02.py -b 64 -P 8 -C 2 -d 3 --shutdown abort --shutdown-timeout 2
+
+    # Engine asyncio (corrotinas sobre anel assíncrono) vs threads, com muitos produtores/consumidores
+        # python ex02.py --engine asyncio -b 64 -P 1000 -C 1000 -d 5
+        # python ex02.py --sweep 64 --engine thread,asyncio -P 10,100,10000 -C 10,100,10000 -d 5
+
+    # Varredura multidimensional (buffer × P × C × faixas de sleep), repetições com IC 95%, em paralelo
+        # python ex02.py --sweep 1,4,16 -P 2,8 -C 2,8 --psleep 1-5,0-1 --trials 5 --jobs 8 -d 3 --out sweep.csv
+        # python ex02.py --sweep 1,4,16 -P 2,8 -C 2 --trials 3 --jobs 4 -d 3 --out sweep.json
+
+    # Saturação: sem sleeps, itens pré-gerados, trabalho de CPU sintético opcional; itens/s, ns/item, trocas de contexto
+        # python ex02.py --saturate -b 64 -P 1 -C 1 -d 3 --impl sem,ring,mpmc --sweep 64
+        # python ex02.py --saturate --work 200 -b 16 -P 4 -C 4 -d 3
+
+    # Buffer com faixas de prioridade (capacidade por faixa, get estrito ou ponderado) e latência por faixa
+        # python ex02.py --impl lanes --lane-caps 4,28 --lane-mix 0.1 --lane-policy strict -P 8 -C 2 -d 5
+        # python ex02.py --impl lanes --lane-caps 4,28 --lane-policy weighted --lane-weights 4,1 -P 8 -C 2 -d 5
+
 # -*- coding: utf-8 -*-
 import argparse
+import asyncio
+import bisect
+import itertools
+import json
 import random
+import statistics
 import threading as th
 import time
+from array import array
 from collections import deque
-from typing import Deque, Optional, Tuple, List
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Deque, Dict, Optional, Tuple, List
+
+try:
+    import resource  # trocas de contexto via getrusage (só Unix)
+except ImportError:
+    resource = None
 
 NS = 1_000_000_000
+IMPLS = ("sem", "ring", "mpmc", "lanes")
+LANE_POLICIES = ("strict", "weighted")
+SHUTDOWN_MODES = ("drain", "abort")
+ENGINES = ("thread", "asyncio")
+SAT_ITEMS = 1 << 14  # itens pré-gerados por produtor no modo --saturate (reusados em ciclo)
 
 def now_ns() -> int:
     return time.perf_counter_ns()
@@ -30,6 +73,8 @@ class BoundedCircularBuffer:
       - Semáforo filled_slots: quantos itens disponíveis existem
       - Mutex para acessar/alterar o deque
     Medimos o tempo bloqueado em empty_slots / filled_slots como 'espera'.
+    Encerramento (close): cada semáforo ganha um "bastão" extra; quem acorda e
+    vê o buffer fechado devolve a ficha antes de sair, acordando o próximo.
     """
     def __init__(self, capacity: int):
         assert capacity > 0
@@ -38,12 +83,16 @@ class BoundedCircularBuffer:
         self.lock = th.Lock()
         self.empty_slots = th.Semaphore(capacity)
         self.filled_slots = th.Semaphore(0)
-        self.running = True  # para indicar fim ordenado
+        self.running = True   # False depois de close(): put falha
+        self.aborted = False  # close(drain=False): get também falha, mesmo com itens
+
+    def __len__(self) -> int:
+        return len(self.q)
 
     def put(self, item: int) -> Tuple[bool, int]:
         """
         Enfileira item. Retorna (ok, wait_ns).
-        ok=False se running foi desativado enquanto aguardava (não usado aqui, mas deixado para extensões).
+        ok=False se o buffer foi fechado (antes ou enquanto aguardava).
         """
         t0 = now_ns()
         self.empty_slots.acquire()  # bloqueia até haver espaço
@@ -51,7 +100,7 @@ class BoundedCircularBuffer:
         # região crítica
         with self.lock:
             if not self.running:
-                # desaloca o espaço que pegamos
+                # devolve a ficha: acorda o próximo produtor preso
                 self.empty_slots.release()
                 return (False, wait_ns)
             self.q.append(item)
@@ -67,55 +116,678 @@ class BoundedCircularBuffer:
         self.filled_slots.acquire()  # bloqueia até haver item
         wait_ns = now_ns() - t0
         with self.lock:
-            if not self.running and len(self.q) == 0:
-                # sinal para encerrar
+            if self.aborted or (not self.running and len(self.q) == 0):
+                # fechado e sem nada a drenar: repassa o bastão ao próximo consumidor
                 self.filled_slots.release()
                 return (None, wait_ns, False)
             item = self.q.popleft()
         self.empty_slots.release()
         return (item, wait_ns, True)
 
-    def stop(self):
-        # sinaliza parada, mas não “desbloqueia” quem está esperando:
-        # o driver é quem finaliza o escoamento.
+    def put_many(self, items: List[int]) -> Tuple[int, int]:
+        """
+        Enfileira todos os itens, em rodadas: bloqueia por 1 vaga, pega sem
+        bloquear as vagas livres que houver (até o resto do lote) e insere essas k
+        de uma vez sob UMA aquisição do lock. Retorna (n_enfileirados, wait_ns);
+        n < len(items) só se o buffer parou.
+        """
+        done, wait_ns, n = 0, 0, len(items)
+        while done < n:
+            t0 = now_ns()
+            self.empty_slots.acquire()
+            wait_ns += now_ns() - t0
+            k = 1
+            while done + k < n and self.empty_slots.acquire(blocking=False):
+                k += 1
+            with self.lock:
+                if not self.running:
+                    self.empty_slots.release(k)
+                    return (done, wait_ns)
+                self.q.extend(items[done:done + k])
+            self.filled_slots.release(k)
+            done += k
+        return (done, wait_ns)
+
+    def get_many(self, max_n: int, timeout: Optional[float] = None) -> Tuple[List[int], int, bool]:
+        """
+        Retira até max_n itens: espera no máximo `timeout` s pelo primeiro e leva
+        os que já estiverem disponíveis, sob uma aquisição do lock.
+        Retorna (itens, wait_ns, ok); timeout → ([], wait_ns, True).
+        """
+        t0 = now_ns()
+        if not self.filled_slots.acquire(timeout=timeout):
+            return ([], now_ns() - t0, True)
+        wait_ns = now_ns() - t0
+        k = 1
+        while k < max_n and self.filled_slots.acquire(blocking=False):
+            k += 1
+        with self.lock:
+            take = 0 if self.aborted else min(k, len(self.q))
+            items = [self.q.popleft() for _ in range(take)]
+        if take < k:
+            # bastão de close(): devolve para acordar os outros consumidores
+            self.filled_slots.release(k - take)
+        if take == 0:
+            return ([], wait_ns, False)
+        self.empty_slots.release(take)
+        return (items, wait_ns, True)
+
+    def close(self, drain: bool = True):
+        """
+        Fecha o buffer e acorda quem estiver bloqueado: put passa a falhar na hora;
+        com drain=True os consumidores ainda levam o que restou e só então recebem
+        ok=False; com drain=False (abort) recebem ok=False já, e o resto fica no buffer.
+        """
         with self.lock:
+            if not self.running:
+                return
             self.running = False
+            self.aborted = not drain
+        self.empty_slots.release()
+        self.filled_slots.release()
+
+class RingBuffer:
+    """
+    Buffer em anel pré-alocado: lista fixa de `capacity` slots e contadores
+    monotônicos head (consumidos) / tail (produzidos); ocupação = tail - head.
+      - Só o lado produtor escreve tail e só o consumidor escreve head; com o GIL
+        cada leitura/escrita de atributo é atômica, então com 1 produtor e 1
+        consumidor (SPSC) o caminho rápido não usa trava nenhuma.
+      - Com vários produtores (ou consumidores) cada lado ganha UMA trava própria
+        (fila de duas travas): produtores não disputam com consumidores.
+        multi=True força as duas travas mesmo com P=C=1 (variante MPMC pura).
+      - Cheio/vazio: solta a trava do lado e espera em Condition, só no caminho
+        lento. Quem espera se registra em p_waiting/c_waiting ANTES de reconferir o
+        estado, e o outro lado só notifica se vê alguém registrado (sem wakeup
+        perdido e sem custo quando ninguém espera).
+    """
+    def __init__(self, capacity: int, producers: int = 1, consumers: int = 1, multi: bool = False):
+        assert capacity > 0
+        self.capacity = capacity
+        self.slots: List[Optional[int]] = [None] * capacity
+        self.head = 0
+        self.tail = 0
+        self.p_lock = th.Lock() if multi or producers > 1 else None
+        self.c_lock = th.Lock() if multi or consumers > 1 else None
+        self.not_full = th.Condition(th.Lock())
+        self.not_empty = th.Condition(th.Lock())
+        self.p_waiting = 0
+        self.c_waiting = 0
+        self.running = True
+        self.aborted = False
+
+    def __len__(self) -> int:
+        return self.tail - self.head
+
+    def _wait_not_full(self):
+        with self.not_full:
+            self.p_waiting += 1
+            try:
+                while self.running and self.tail - self.head >= self.capacity:
+                    self.not_full.wait()
+            finally:
+                self.p_waiting -= 1
+
+    def _wait_not_empty(self, timeout: Optional[float] = None) -> bool:
+        with self.not_empty:
+            self.c_waiting += 1
+            try:
+                return self.not_empty.wait_for(lambda: not self.running or self.tail != self.head, timeout)
+            finally:
+                self.c_waiting -= 1
+
+    def put(self, item: int) -> Tuple[bool, int]:
+        t0 = now_ns()
+        lk = self.p_lock
+        while True:
+            if lk is not None:
+                lk.acquire()
+            tail = self.tail
+            if tail - self.head < self.capacity or not self.running:
+                break
+            # cheio: solta a trava do lado antes de dormir (outros produtores esperam
+            # na Condition, não enfileirados atrás desta trava)
+            if lk is not None:
+                lk.release()
+            self._wait_not_full()
+        try:
+            wait_ns = now_ns() - t0
+            if not self.running:
+                return (False, wait_ns)
+            self.slots[tail % self.capacity] = item
+            self.tail = tail + 1  # publica o slot só depois de escrito
+        finally:
+            if lk is not None:
+                lk.release()
+        if self.c_waiting:
+            with self.not_empty:
+                self.not_empty.notify()
+        return (True, wait_ns)
+
+    def get(self) -> Tuple[Optional[int], int, bool]:
+        t0 = now_ns()
+        lk = self.c_lock
+        while True:
+            if lk is not None:
+                lk.acquire()
+            head = self.head
+            if self.tail != head and not self.aborted:
+                break
+            if lk is not None:
+                lk.release()
+            if not self.running:  # fechado e vazio (ou abortado)
+                # close(drain) pode ter vindo logo depois de um put publicar:
+                # reconfere tail antes de desistir, senão o item fica sem consumidor
+                if self.tail != self.head and not self.aborted:
+                    continue
+                return (None, now_ns() - t0, False)
+            self._wait_not_empty()
+        try:
+            wait_ns = now_ns() - t0
+            i = head % self.capacity
+            item = self.slots[i]
+            self.slots[i] = None
+            self.head = head + 1
+        finally:
+            if lk is not None:
+                lk.release()
+        if self.p_waiting:
+            with self.not_full:
+                self.not_full.notify()
+        return (item, wait_ns, True)
+
+    def put_many(self, items: List[int]) -> Tuple[int, int]:
+        """Como put, mas escreve todas as vagas livres de uma vez e publica tail uma vez por rodada."""
+        done, wait_ns, n = 0, 0, len(items)
+        cap = self.capacity
+        lk = self.p_lock
+        while done < n:
+            t0 = now_ns()
+            while True:
+                if lk is not None:
+                    lk.acquire()
+                tail = self.tail
+                free = cap - (tail - self.head)
+                if free > 0 or not self.running:
+                    break
+                if lk is not None:
+                    lk.release()
+                self._wait_not_full()
+            wait_ns += now_ns() - t0
+            try:
+                if not self.running:
+                    return (done, wait_ns)
+                k = min(free, n - done)
+                slots = self.slots
+                for j in range(k):
+                    slots[(tail + j) % cap] = items[done + j]
+                self.tail = tail + k
+            finally:
+                if lk is not None:
+                    lk.release()
+            done += k
+            if self.c_waiting:
+                with self.not_empty:
+                    self.not_empty.notify(k)
+        return (done, wait_ns)
+
+    def get_many(self, max_n: int, timeout: Optional[float] = None) -> Tuple[List[int], int, bool]:
+        """Como get, mas leva até max_n itens disponíveis; espera no máximo `timeout` s pelo primeiro."""
+        t0 = now_ns()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        lk = self.c_lock
+        while True:
+            if lk is not None:
+                lk.acquire()
+            head = self.head
+            avail = self.tail - head
+            if avail > 0 and not self.aborted:
+                break
+            if lk is not None:
+                lk.release()
+            if not self.running:
+                if self.tail != self.head and not self.aborted:
+                    continue  # publicado antes do close(drain): ainda precisa ser drenado
+                return ([], now_ns() - t0, False)
+            left = None if deadline is None else deadline - time.monotonic()
+            if (left is not None and left <= 0) or not self._wait_not_empty(left):
+                return ([], now_ns() - t0, True)
+        try:
+            wait_ns = now_ns() - t0
+            k = min(avail, max_n)
+            cap, slots = self.capacity, self.slots
+            items = []
+            for j in range(k):
+                i = (head + j) % cap
+                items.append(slots[i])
+                slots[i] = None
+            self.head = head + k
+        finally:
+            if lk is not None:
+                lk.release()
+        if self.p_waiting:
+            with self.not_full:
+                self.not_full.notify(k)
+        return (items, wait_ns, True)
+
+    def close(self, drain: bool = True):
+        """Mesma semântica de BoundedCircularBuffer.close: acorda todos os esperando dos dois lados."""
+        with self.not_full:
+            self.aborted = self.aborted or (self.running and not drain)
+            self.running = False
+            self.not_full.notify_all()
+        with self.not_empty:
+            self.not_empty.notify_all()
+
+class LaneBuffer:
+    """
+    Buffer com várias faixas FIFO (faixa 0 = mais urgente), cada uma com sua
+    capacidade, sob UM lock:
+      - produtor bloqueia só se a SUA faixa estiver cheia (not_full por faixa):
+        bulk cheio não segura urgente;
+      - contagem total compartilhada (count/not_empty) para os consumidores;
+      - get escolhe a faixa: strict = a mais urgente não vazia; weighted =
+        round-robin ponderado suave entre as não vazias (pesos = lane_weights).
+    A faixa de um item sai do próprio valor (item % 10007 contra as frações de
+    `mix`), então itens pré-gerados e put_many funcionam sem mudar a interface.
+    O tempo de cada item na fila (put → get) vai para um histograma por faixa.
+    """
+    def __init__(self, caps: List[int], mix: List[float], policy: str = "strict",
+                 weights: Optional[List[int]] = None):
+        assert caps and all(c > 0 for c in caps)
+        self.caps = caps
+        self.capacity = sum(caps)
+        self.lanes: List[Deque[Tuple[int, int]]] = [deque() for _ in caps]
+        self.lock = th.Lock()
+        self.not_empty = th.Condition(self.lock)
+        self.not_full = [th.Condition(self.lock) for _ in caps]
+        self.count = 0
+        acc, self.cum = 0.0, []
+        for f in mix[:len(caps) - 1]:
+            acc += f
+            self.cum.append(acc)
+        self.policy = policy
+        self.weights = weights or [1] * len(caps)
+        self.credit = [0] * len(caps)
+        self.lat = [LogHistogram() for _ in caps]
+        self.served = [0] * len(caps)
+        self.running = True
+        self.aborted = False
+
+    def __len__(self) -> int:
+        return self.count
+
+    def lane_of(self, item: int) -> int:
+        return bisect.bisect_right(self.cum, (item % 10007) / 10007)
+
+    def _pick(self) -> int:
+        lanes = self.lanes
+        if self.policy == "strict":
+            for i, q in enumerate(lanes):
+                if q:
+                    return i
+        # round-robin ponderado suave (estilo nginx): cada faixa não vazia ganha seu
+        # peso em crédito; a de maior crédito é servida e paga a soma dos pesos
+        best, total = -1, 0
+        for i, q in enumerate(lanes):
+            if q:
+                w = self.weights[i]
+                self.credit[i] += w
+                total += w
+                if best < 0 or self.credit[i] > self.credit[best]:
+                    best = i
+        self.credit[best] -= total
+        return best
+
+    def _take(self) -> int:
+        i = self._pick()
+        item, t_in = self.lanes[i].popleft()
+        self.count -= 1
+        self.lat[i].record(now_ns() - t_in)
+        self.served[i] += 1
+        self.not_full[i].notify()
+        return item
+
+    def put(self, item: int) -> Tuple[bool, int]:
+        lane = self.lane_of(item)
+        q, cap, cv = self.lanes[lane], self.caps[lane], self.not_full[lane]
+        t0 = now_ns()
+        with self.lock:
+            while self.running and len(q) >= cap:
+                cv.wait()
+            wait_ns = now_ns() - t0
+            if not self.running:
+                return (False, wait_ns)
+            q.append((item, now_ns()))
+            self.count += 1
+            self.not_empty.notify()
+        return (True, wait_ns)
+
+    def get(self) -> Tuple[Optional[int], int, bool]:
+        t0 = now_ns()
+        with self.lock:
+            while self.running and self.count == 0:
+                self.not_empty.wait()
+            wait_ns = now_ns() - t0
+            if self.aborted or self.count == 0:
+                return (None, wait_ns, False)
+            return (self._take(), wait_ns, True)
+
+    def put_many(self, items: List[int]) -> Tuple[int, int]:
+        # itens de um lote podem cair em faixas diferentes: um put por item
+        done, wait_ns = 0, 0
+        for item in items:
+            ok, w = self.put(item)
+            wait_ns += w
+            if not ok:
+                break
+            done += 1
+        return (done, wait_ns)
+
+    def get_many(self, max_n: int, timeout: Optional[float] = None) -> Tuple[List[int], int, bool]:
+        t0 = now_ns()
+        with self.lock:
+            if not self.not_empty.wait_for(lambda: not self.running or self.count > 0, timeout):
+                return ([], now_ns() - t0, True)
+            wait_ns = now_ns() - t0
+            if self.aborted or self.count == 0:
+                return ([], wait_ns, False)
+            return ([self._take() for _ in range(min(max_n, self.count))], wait_ns, True)
+
+    def close(self, drain: bool = True):
+        with self.lock:
+            if not self.running:
+                return
+            self.running = False
+            self.aborted = not drain
+            self.not_empty.notify_all()
+            for cv in self.not_full:
+                cv.notify_all()
+
+    def lane_stats(self) -> List[dict]:
+        with self.lock:
+            return [{"cap": c, "served": n, "p50_ms": h.percentile(50) / 1e6, "p99_ms": h.percentile(99) / 1e6}
+                    for c, n, h in zip(self.caps, self.served, self.lat)]
+
+def lane_config(buffer_cap: int, caps_spec: str, mix_spec: str, weights_spec: str) -> Tuple[List[int], List[float], List[int]]:
+    """
+    Capacidades (padrão: 2 faixas, urgente com 1/4 do buffer), frações das
+    faixas 0..n-2 (a última leva o resto; padrão 10% urgente) e pesos (padrão 1).
+    Faltando frações, o resto é dividido igualmente entre as faixas sem fração
+    e a última. Capacidades explícitas precisam somar buffer_cap.
+    """
+    caps = [max(1, int(x)) for x in caps_spec.split(",") if x.strip()]
+    if not caps:
+        if buffer_cap < 2:
+            raise SystemExit(f"--impl lanes precisa de buffer >= 2 (uma vaga por faixa), recebeu {buffer_cap}")
+        urgent = max(1, buffer_cap // 4)
+        caps = [urgent, buffer_cap - urgent]
+    elif sum(caps) != buffer_cap:
+        raise SystemExit(f"--lane-caps soma {sum(caps)}, mas o buffer é {buffer_cap}: "
+                         f"use -b {sum(caps)} (ou omita -b/--sweep)")
+    mix = [float(x) for x in mix_spec.split(",") if x.strip()] or [0.1]
+    if len(mix) > len(caps) - 1:
+        raise SystemExit(f"--lane-mix tem {len(mix)} frações para {len(caps)} faixas (máximo {len(caps) - 1}; a última leva o resto)")
+    if any(f < 0 for f in mix) or sum(mix) > 1:
+        raise SystemExit(f"--lane-mix inválido: frações devem ser >= 0 e somar no máximo 1 ({mix_spec})")
+    missing = len(caps) - 1 - len(mix)
+    mix += [(1 - sum(mix)) / (missing + 1)] * missing
+    weights = [max(1, int(x)) for x in weights_spec.split(",") if x.strip()]
+    weights = (weights + [1] * len(caps))[:len(caps)]
+    return caps, mix, weights
+
+def make_buffer(impl: str, capacity: int, P: int, C: int, lanes: Optional[tuple] = None):
+    if impl == "sem":
+        return BoundedCircularBuffer(capacity)
+    if impl == "lanes":
+        caps, mix, policy, weights = lanes
+        return LaneBuffer(caps, mix, policy, weights)
+    return RingBuffer(capacity, producers=P, consumers=C, multi=(impl == "mpmc"))
+
+class AsyncRingBuffer:
+    """
+    Anel limitado para a engine asyncio: mesma interface de RingBuffer (put/get,
+    put_many/get_many, close, len), mas as operações são corrotinas. Tudo roda
+    numa thread só, então não há trava: quem encontra o anel cheio/vazio estaciona
+    num Future na fila de espera do seu lado e o outro lado acorda um por item.
+    """
+    def __init__(self, capacity: int):
+        assert capacity > 0
+        self.capacity = capacity
+        self.slots: List[Optional[int]] = [None] * capacity
+        self.head = 0
+        self.tail = 0
+        self._putters: Deque[asyncio.Future] = deque()
+        self._getters: Deque[asyncio.Future] = deque()
+        self.running = True
+        self.aborted = False
+
+    def __len__(self) -> int:
+        return self.tail - self.head
+
+    @staticmethod
+    def _wake(waiters: Deque[asyncio.Future], n: int = 1):
+        while n > 0 and waiters:
+            fut = waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                n -= 1
+
+    async def _park(self, waiters: Deque[asyncio.Future], timeout: Optional[float] = None) -> bool:
+        fut = asyncio.get_running_loop().create_future()
+        waiters.append(fut)
+        if timeout is None:
+            await fut
+            return True
+        try:
+            await asyncio.wait_for(fut, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def put(self, item: int) -> Tuple[bool, int]:
+        t0 = now_ns()
+        while self.running and self.tail - self.head >= self.capacity:
+            await self._park(self._putters)
+        wait_ns = now_ns() - t0
+        if not self.running:
+            return (False, wait_ns)
+        self.slots[self.tail % self.capacity] = item
+        self.tail += 1
+        self._wake(self._getters)
+        return (True, wait_ns)
+
+    async def get(self) -> Tuple[Optional[int], int, bool]:
+        t0 = now_ns()
+        while self.running and self.tail == self.head:
+            await self._park(self._getters)
+        wait_ns = now_ns() - t0
+        if self.aborted or self.tail == self.head:
+            return (None, wait_ns, False)
+        i = self.head % self.capacity
+        item = self.slots[i]
+        self.slots[i] = None
+        self.head += 1
+        self._wake(self._putters)
+        return (item, wait_ns, True)
+
+    async def put_many(self, items: List[int]) -> Tuple[int, int]:
+        done, wait_ns, n = 0, 0, len(items)
+        while done < n:
+            t0 = now_ns()
+            while self.running and self.tail - self.head >= self.capacity:
+                await self._park(self._putters)
+            wait_ns += now_ns() - t0
+            if not self.running:
+                break
+            k = min(self.capacity - (self.tail - self.head), n - done)
+            for j in range(k):
+                self.slots[(self.tail + j) % self.capacity] = items[done + j]
+            self.tail += k
+            done += k
+            self._wake(self._getters, k)
+        return (done, wait_ns)
+
+    async def get_many(self, max_n: int, timeout: Optional[float] = None) -> Tuple[List[int], int, bool]:
+        t0 = now_ns()
+        if self.running and self.tail == self.head:
+            if not await self._park(self._getters, timeout) and self.tail == self.head:
+                return ([], now_ns() - t0, True)
+            while self.running and self.tail == self.head:
+                await self._park(self._getters)
+        wait_ns = now_ns() - t0
+        if self.aborted or self.tail == self.head:
+            return ([], wait_ns, False)
+        k = min(self.tail - self.head, max_n)
+        items = []
+        for j in range(k):
+            i = (self.head + j) % self.capacity
+            items.append(self.slots[i])
+            self.slots[i] = None
+        self.head += k
+        self._wake(self._putters, k)
+        return (items, wait_ns, True)
+
+    def close(self, drain: bool = True):
+        if not self.running:
+            return
+        self.running = False
+        self.aborted = not drain
+        self._wake(self._putters, len(self._putters))
+        self._wake(self._getters, len(self._getters))
+
+class LogHistogram:
+    """
+    Histograma log-bucketed (valores inteiros ≥ 0, aqui espera em ns): valores < 16
+    têm bucket exato; acima disso, 16 sub-buckets por potência de 2 (erro
+    relativo ≤ 1/16). record() é O(1) e não aloca.
+    """
+    SUB_BITS = 4
+    SUB = 1 << SUB_BITS
+    NBUCKETS = SUB + 60 * SUB
+    __slots__ = ("counts", "max")
+
+    def __init__(self):
+        self.counts = [0] * self.NBUCKETS
+        self.max = 0
+
+    def record(self, v: int):
+        if v < 16:
+            i = v if v > 0 else 0
+        else:
+            e = v.bit_length() - 5
+            i = 16 + (e << 4) + (v >> e) - 16
+        self.counts[i] += 1
+        if v > self.max:
+            self.max = v
+
+    @classmethod
+    def bucket_hi(cls, i: int) -> int:
+        """Limite superior (exclusivo) dos valores do bucket i."""
+        if i < cls.SUB:
+            return i + 1
+        e = (i - cls.SUB) >> cls.SUB_BITS
+        m = cls.SUB + ((i - cls.SUB) & (cls.SUB - 1))
+        return (m + 1) << e
+
+    def merge(self, other: "LogHistogram"):
+        for i, c in enumerate(other.counts):
+            if c:
+                self.counts[i] += c
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p: float) -> int:
+        """Limite superior do bucket do p-ésimo percentil (nunca acima do máximo)."""
+        n = sum(self.counts)
+        if n == 0:
+            return 0
+        rank = max(1, int(round(p / 100.0 * n)))
+        acc = 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if acc >= rank:
+                return min(self.bucket_hi(i) - 1, self.max)
+        return self.max
+
+class LocalMetrics:
+    """Acumuladores de uma thread/corrotina: escritos só pelo dono, sem trava no caminho quente."""
+    __slots__ = ("produced", "consumed", "p_wait_total_ns", "c_wait_total_ns",
+                 "p_attempts", "c_attempts", "p_hist", "c_hist")
 
-class Metrics:
     def __init__(self):
-        self.mtx = th.Lock()
-        # contadores
         self.produced = 0
         self.consumed = 0
-        # esperas acumuladas (ns) e tentativas (para médias)
         self.p_wait_total_ns = 0
         self.c_wait_total_ns = 0
         self.p_attempts = 0
         self.c_attempts = 0
+        self.p_hist = LogHistogram()
+        self.c_hist = LogHistogram()
 
-    def add_prod(self, wait_ns: int):
-        with self.mtx:
-            self.produced += 1
-            self.p_attempts += 1
-            self.p_wait_total_ns += wait_ns
+    def add_prod(self, wait_ns: int, n: int = 1):
+        # n itens numa operação (put_many): a espera conta uma vez por operação
+        self.produced += n
+        self.p_attempts += 1
+        self.p_wait_total_ns += wait_ns
+        self.p_hist.record(wait_ns)
 
-    def add_cons(self, wait_ns: int):
+    def add_cons(self, wait_ns: int, n: int = 1):
+        self.consumed += n
+        self.c_attempts += 1
+        self.c_wait_total_ns += wait_ns
+        self.c_hist.record(wait_ns)
+
+class Metrics:
+    """
+    Registro dos acumuladores locais: mtx só é tomado ao registrar um novo
+    LocalMetrics (uma vez por thread) e no snapshot, que funde todos.
+    """
+    def __init__(self):
+        self.mtx = th.Lock()
+        self.locals: List[LocalMetrics] = []
+
+    def local(self) -> LocalMetrics:
+        lm = LocalMetrics()
         with self.mtx:
-            self.consumed += 1
-            self.c_attempts += 1
-            self.c_wait_total_ns += wait_ns
+            self.locals.append(lm)
+        return lm
 
     def snapshot(self):
+        # lido depois dos joins (ou com as threads paradas): soma campo a campo
+        with self.mtx:
+            ls = list(self.locals)
+        return (sum(l.produced for l in ls), sum(l.consumed for l in ls),
+                sum(l.p_wait_total_ns for l in ls), sum(l.c_wait_total_ns for l in ls),
+                sum(l.p_attempts for l in ls), sum(l.c_attempts for l in ls))
+
+    def wait_histograms(self) -> Tuple[LogHistogram, LogHistogram]:
+        p_h, c_h = LogHistogram(), LogHistogram()
         with self.mtx:
-            return (self.produced, self.consumed,
-                    self.p_wait_total_ns, self.c_wait_total_ns,
-                    self.p_attempts, self.c_attempts)
+            ls = list(self.locals)
+        for l in ls:
+            p_h.merge(l.p_hist)
+            c_h.merge(l.c_hist)
+        return p_h, c_h
 
-def producer_loop(buf: BoundedCircularBuffer,
+def producer_loop(buf,
                   metrics: Metrics,
                   sleep_min_ms: int, sleep_max_ms: int,
-                  rng_seed: int):
+                  rng_seed: int, batch: int = 1):
     rnd = random.Random(rng_seed)
+    m = metrics.local()
+    if batch > 1:
+        # rajada: produz o lote inteiro e entrega com um put_many
+        while buf.running:
+            items = []
+            for _ in range(batch):
+                sleep_ms(rnd.randint(sleep_min_ms, sleep_max_ms))
+                items.append(rnd.randrange(1, 1_000_000_000))
+            n, wait_ns = buf.put_many(items)
+            if n:
+                m.add_prod(wait_ns, n)
+            if n < len(items):
+                break
+        return
     while buf.running:
         # simula tempo para produzir
         sleep_ms(rnd.randint(sleep_min_ms, sleep_max_ms))
@@ -124,82 +796,304 @@ def producer_loop(buf: BoundedCircularBuffer,
         ok, wait_ns = buf.put(item)
         if not ok:
             break
-        metrics.add_prod(wait_ns)
+        m.add_prod(wait_ns)
 
-def consumer_loop(buf: BoundedCircularBuffer,
+def consumer_loop(buf,
                   metrics: Metrics,
                   sleep_min_ms: int, sleep_max_ms: int,
-                  rng_seed: int):
+                  rng_seed: int, batch: int = 1):
     rnd = random.Random(rng_seed)
+    m = metrics.local()
+    if batch > 1:
+        while True:
+            items, wait_ns, ok = buf.get_many(batch)
+            if not ok:
+                break
+            for _ in items:
+                sleep_ms(rnd.randint(sleep_min_ms, sleep_max_ms))
+            m.add_cons(wait_ns, len(items))
+        return
     while True:
         item, wait_ns, ok = buf.get()
         if not ok:
             break
         # simula tempo para consumir
         sleep_ms(rnd.randint(sleep_min_ms, sleep_max_ms))
-        metrics.add_cons(wait_ns)
+        m.add_cons(wait_ns)
 
-def run_once(buffer_cap: int, P: int, C: int, duration_s: int,
-             pmin: int, pmax: int, cmin: int, cmax: int) -> dict:
+# ----------------------------
+# Modo saturação: sem sleeps, itens pré-gerados
+# ----------------------------
+def make_items(seed: int, n: int = SAT_ITEMS) -> array:
+    rnd = random.Random(seed)
+    return array("q", (rnd.randrange(1, 1_000_000_000) for _ in range(n)))
+
+def cpu_work(iters: int) -> int:
+    """Trabalho de CPU sintético (segura o GIL): `iters` voltas de um laço Python."""
+    x = 0
+    for k in range(iters):
+        x += k
+    return x
+
+def sat_producer_loop(buf, metrics: Metrics, items: array, work: int, batch: int = 1):
+    # nada de RNG nem sleep no caminho medido: só percorre o array pré-gerado
+    m = metrics.local()
+    if batch > 1:
+        chunks = [items[j:j + batch].tolist() for j in range(0, len(items), batch)]
+        i = 0
+        while buf.running:
+            chunk = chunks[i]
+            i = i + 1 if i + 1 < len(chunks) else 0
+            if work:
+                cpu_work(work * len(chunk))
+            n, wait_ns = buf.put_many(chunk)
+            if n:
+                m.add_prod(wait_ns, n)
+            if n < len(chunk):
+                break
+        return
+    n_items, i = len(items), 0
+    while buf.running:
+        if work:
+            cpu_work(work)
+        ok, wait_ns = buf.put(items[i])
+        if not ok:
+            break
+        i = i + 1 if i + 1 < n_items else 0
+        m.add_prod(wait_ns)
+
+def sat_consumer_loop(buf, metrics: Metrics, work: int, batch: int = 1):
+    m = metrics.local()
+    if batch > 1:
+        while True:
+            items, wait_ns, ok = buf.get_many(batch)
+            if not ok:
+                break
+            if work:
+                cpu_work(work * len(items))
+            m.add_cons(wait_ns, len(items))
+        return
+    while True:
+        item, wait_ns, ok = buf.get()
+        if not ok:
+            break
+        if work:
+            cpu_work(work)
+        m.add_cons(wait_ns)
+
+async def sat_producer_coro(buf: AsyncRingBuffer, metrics: Metrics, items: array, work: int, batch: int = 1):
+    # só cede o loop quando o anel enche (put estaciona): é o custo puro do buffer
+    m = metrics.local()
+    n_items, i = len(items), 0
+    while buf.running:
+        if work:
+            cpu_work(work * batch)
+        if batch > 1:
+            chunk = [items[(i + j) % n_items] for j in range(batch)]
+            n, wait_ns = await buf.put_many(chunk)
+            if n:
+                m.add_prod(wait_ns, n)
+            if n < batch:
+                break
+            i = (i + batch) % n_items
+        else:
+            ok, wait_ns = await buf.put(items[i])
+            if not ok:
+                break
+            i = i + 1 if i + 1 < n_items else 0
+            m.add_prod(wait_ns)
+
+async def sat_consumer_coro(buf: AsyncRingBuffer, metrics: Metrics, work: int, batch: int = 1):
+    m = metrics.local()
+    while True:
+        if batch > 1:
+            items, wait_ns, ok = await buf.get_many(batch)
+            n = len(items)
+        else:
+            _, wait_ns, ok = await buf.get()
+            n = 1
+        if not ok:
+            break
+        if work:
+            cpu_work(work * n)
+        m.add_cons(wait_ns, n)
+
+def ctx_switches() -> Tuple[int, int]:
+    """(voluntárias, involuntárias) do processo inteiro, todas as threads; (0, 0) sem resource."""
+    if resource is None:
+        return (0, 0)
+    ru = resource.getrusage(resource.RUSAGE_SELF)
+    return (ru.ru_nvcsw, ru.ru_nivcsw)
+
+async def asleep_ms(ms: float) -> None:
+    # sleep 0 ainda cede o loop: sem isso um produtor que nunca bloqueia monopoliza a thread
+    await asyncio.sleep(ms / 1000.0 if ms > 0 else 0)
+
+async def producer_coro(buf: AsyncRingBuffer,
+                        metrics: Metrics,
+                        sleep_min_ms: int, sleep_max_ms: int,
+                        rng_seed: int, batch: int = 1):
+    # mesma lógica de producer_loop, com await nos pontos de espera
+    rnd = random.Random(rng_seed)
+    m = metrics.local()
+    if batch > 1:
+        while buf.running:
+            items = []
+            for _ in range(batch):
+                await asleep_ms(rnd.randint(sleep_min_ms, sleep_max_ms))
+                items.append(rnd.randrange(1, 1_000_000_000))
+            n, wait_ns = await buf.put_many(items)
+            if n:
+                m.add_prod(wait_ns, n)
+            if n < len(items):
+                break
+        return
+    while buf.running:
+        await asleep_ms(rnd.randint(sleep_min_ms, sleep_max_ms))
+        item = rnd.randrange(1, 1_000_000_000)
+        ok, wait_ns = await buf.put(item)
+        if not ok:
+            break
+        m.add_prod(wait_ns)
+
+async def consumer_coro(buf: AsyncRingBuffer,
+                        metrics: Metrics,
+                        sleep_min_ms: int, sleep_max_ms: int,
+                        rng_seed: int, batch: int = 1):
+    rnd = random.Random(rng_seed)
+    m = metrics.local()
+    if batch > 1:
+        while True:
+            items, wait_ns, ok = await buf.get_many(batch)
+            if not ok:
+                break
+            for _ in items:
+                await asleep_ms(rnd.randint(sleep_min_ms, sleep_max_ms))
+            m.add_cons(wait_ns, len(items))
+        return
+    while True:
+        item, wait_ns, ok = await buf.get()
+        if not ok:
+            break
+        await asleep_ms(rnd.randint(sleep_min_ms, sleep_max_ms))
+        m.add_cons(wait_ns)
+
+async def drive_async(buf: AsyncRingBuffer, cons: List[tuple], prods: List[tuple], duration_s: int,
+                      shutdown: str, shutdown_timeout: float) -> Tuple[int, int, int, int]:
     """
-    Executa um experimento e retorna métricas agregadas.
-    pmin/pmax/cmin/cmax em milissegundos.
+    Roda a engine asyncio: cons/prods são listas de (corrotina, args).
+    Retorna (start_ns, close_ns, end_ns, stragglers).
     """
-    buf = BoundedCircularBuffer(buffer_cap)
-    metrics = Metrics()
+    start_ns = now_ns()
+    consumers = [asyncio.create_task(fn(*a)) for fn, a in cons]
+    producers = [asyncio.create_task(fn(*a)) for fn, a in prods]
+    await asyncio.sleep(duration_s)
+    close_ns = now_ns()
+    buf.close(drain=(shutdown == "drain"))
+    _, pending = await asyncio.wait(producers + consumers, timeout=shutdown_timeout)
+    end_ns = now_ns()
+    for t in pending:
+        t.cancel()
+    return start_ns, close_ns, end_ns, len(pending)
 
+def drive_threads(buf, cons: List[tuple], prods: List[tuple], duration_s: int,
+                  shutdown: str, shutdown_timeout: float) -> Tuple[int, int, int, int]:
+    """
+    Roda a engine de threads: cons/prods são listas de (função, args), uma thread cada.
+    Retorna (start_ns, close_ns, end_ns, stragglers).
+    """
     producers: List[th.Thread] = []
     consumers: List[th.Thread] = []
 
     start_ns = now_ns()
 
     # consumidores primeiro (para evitar ‘arranque a frio’)
-    for i in range(C):
-        t = th.Thread(target=consumer_loop,
-                      args=(buf, metrics, cmin, cmax, (i+1)*1337),
-                      daemon=False)
+    for fn, a in cons:
+        t = th.Thread(target=fn, args=a,
+                      daemon=True)  # daemon: um retardatário além do prazo não segura o processo
         consumers.append(t)
         t.start()
 
-    for i in range(P):
-        t = th.Thread(target=producer_loop,
-                      args=(buf, metrics, pmin, pmax, (i+1)*911),
-                      daemon=False)
+    for fn, a in prods:
+        t = th.Thread(target=fn, args=a,
+                      daemon=True)
         producers.append(t)
         t.start()
 
     # roda por duration_s
     time.sleep(duration_s)
 
-    # parar produção e drenar o buffer
-    buf.stop()
-
-    # aguarda produtores
-    for t in producers:
-        t.join(timeout=1.0)
-
-    # Agora precisamos “destravar” consumidores que podem estar presos no filled_slots
-    # Estratégia: enquanto houver itens, os consumidores seguirão fluindo; quando esvaziar,
-    # liberamos C vezes o filled_slots e marcamos ok=False.
-    # Como nosso get() retorna ok=False apenas se running=False E fila vazia,
-    # fazemos um ciclo curto para garantir o desbloqueio final.
-    # (Simplificação: acordar consumidores extras após producers finalizarem)
-    for _ in range(len(consumers)):
-        buf.filled_slots.release()
-
-    for t in consumers:
-        t.join(timeout=1.0)
-
+    # fechar: close() acorda produtores e consumidores bloqueados; cada thread sai
+    # sozinha (drain: depois de esvaziar o buffer). Joins com um prazo único.
+    close_ns = now_ns()
+    buf.close(drain=(shutdown == "drain"))
+    deadline = time.monotonic() + shutdown_timeout
+    for t in producers + consumers:
+        t.join(timeout=max(0.0, deadline - time.monotonic()))
     end_ns = now_ns()
+    stragglers = sum(t.is_alive() for t in producers + consumers)
+    return start_ns, close_ns, end_ns, stragglers
+
+def run_once(buffer_cap: int, P: int, C: int, duration_s: int,
+             pmin: int, pmax: int, cmin: int, cmax: int, impl: str = "sem", batch: int = 1,
+             shutdown: str = "drain", shutdown_timeout: float = 5.0, engine: str = "thread",
+             seed: int = 0, saturate: bool = False, work: int = 0,
+             lane_caps: str = "", lane_mix: str = "", lane_policy: str = "strict", lane_weights: str = "") -> dict:
+    """
+    Executa um experimento e retorna métricas agregadas.
+    pmin/pmax/cmin/cmax em milissegundos.
+    shutdown: drain (consome o que sobrou) | abort (descarta); shutdown_timeout: prazo total dos joins.
+    engine=asyncio: P+C corrotinas numa thread, sobre AsyncRingBuffer (impl é ignorado).
+    seed desloca as sementes dos produtores/consumidores (repetições independentes).
+    saturate: sem sleeps, itens pré-gerados e `work` voltas de CPU sintética por item.
+    lane_*: configuração do impl lanes (ver lane_config); a soma das faixas é buffer_cap.
+    """
+    metrics = Metrics()
+    if engine == "asyncio":
+        impl = "async"
+        buf = AsyncRingBuffer(buffer_cap)
+        c_fn, p_fn = (sat_consumer_coro, sat_producer_coro) if saturate else (consumer_coro, producer_coro)
+    else:
+        lanes = None
+        if impl == "lanes":
+            caps, mix, weights = lane_config(buffer_cap, lane_caps, lane_mix, lane_weights)
+            lanes = (caps, mix, lane_policy, weights)
+        buf = make_buffer(impl, buffer_cap, P, C, lanes)
+        c_fn, p_fn = (sat_consumer_loop, sat_producer_loop) if saturate else (consumer_loop, producer_loop)
+    if saturate:
+        cons = [(c_fn, (buf, metrics, work, batch)) for _ in range(C)]
+        prods = [(p_fn, (buf, metrics, make_items((i+1)*911 + seed), work, batch)) for i in range(P)]
+    else:
+        cons = [(c_fn, (buf, metrics, cmin, cmax, (i+1)*1337 + seed, batch)) for i in range(C)]
+        prods = [(p_fn, (buf, metrics, pmin, pmax, (i+1)*911 + seed, batch)) for i in range(P)]
+    drive_args = (buf, cons, prods, duration_s, shutdown, shutdown_timeout)
+    vcsw0, ivcsw0 = ctx_switches()
+    if engine == "asyncio":
+        start_ns, close_ns, end_ns, stragglers = asyncio.run(drive_async(*drive_args))
+    else:
+        start_ns, close_ns, end_ns, stragglers = drive_threads(*drive_args)
+    vcsw1, ivcsw1 = ctx_switches()
+    undrained = len(buf)
+    lane_stats = buf.lane_stats() if isinstance(buf, LaneBuffer) else []
 
     produced, consumed, p_wait_ns, c_wait_ns, p_att, c_att = metrics.snapshot()
     elapsed_s = (end_ns - start_ns) / NS
     throughput = consumed / elapsed_s if elapsed_s > 0 else 0.0
     avg_p_wait_ms = (p_wait_ns / p_att / 1e6) if p_att else 0.0
     avg_c_wait_ms = (c_wait_ns / c_att / 1e6) if c_att else 0.0
+    p_hist, c_hist = metrics.wait_histograms()
+    pct = {}
+    for side, h in (("p", p_hist), ("c", c_hist)):
+        for q in WAIT_PERCENTILES:
+            pct[f"{side}_wait_p{q}_ms"] = h.percentile(q) / 1e6
+    # itens por get_many: quanto do lote pedido o consumidor realmente leva
+    avg_c_batch = (consumed / c_att) if c_att else 0.0
 
     return {
         "buffer": buffer_cap,
+        "engine": engine,
+        "impl": impl,
+        "batch": batch,
         "P": P,
         "C": C,
         "duration_s": duration_s,
@@ -213,67 +1107,252 @@ def run_once(buffer_cap: int, P: int, C: int, duration_s: int,
         "throughput": throughput,
         "avg_p_wait_ms": avg_p_wait_ms,
         "avg_c_wait_ms": avg_c_wait_ms,
+        "avg_c_batch": avg_c_batch,
+        **pct,
+        "saturate": int(saturate),
+        "work": work,
+        "ns_per_item": (end_ns - start_ns) / consumed if consumed else 0.0,
+        "ctx_vol": vcsw1 - vcsw0,
+        "ctx_invol": ivcsw1 - ivcsw0,
+        # faixas (impl lanes): valores por faixa separados por "|", faixa 0 primeiro
+        "lane_caps": "|".join(str(l["cap"]) for l in lane_stats) or "-",
+        "lane_policy": lane_policy if lane_stats else "-",
+        "lane_served": "|".join(str(l["served"]) for l in lane_stats) or "-",
+        "lane_lat_p50_ms": "|".join(f"{l['p50_ms']:.3f}" for l in lane_stats) or "-",
+        "lane_lat_p99_ms": "|".join(f"{l['p99_ms']:.3f}" for l in lane_stats) or "-",
+        "shutdown": shutdown,
+        "shutdown_ms": (end_ns - close_ns) / 1e6,
+        "undrained": undrained,
+        "stragglers": stragglers,
     }
 
+WAIT_PERCENTILES = (50, 95, 99)
+
+CSV_FIELDS = ["buffer", "engine", "impl", "batch", "P", "C", "duration_s", "pmin_ms", "pmax_ms", "cmin_ms", "cmax_ms",
+              "produced", "consumed", "elapsed_s", "throughput", "avg_p_wait_ms", "avg_c_wait_ms",
+              *(f"{s}_wait_p{q}_ms" for s in ("p", "c") for q in WAIT_PERCENTILES),
+              "avg_c_batch", "shutdown", "shutdown_ms", "undrained", "stragglers",
+              "saturate", "work", "ns_per_item", "ctx_vol", "ctx_invol",
+              "lane_caps", "lane_policy", "lane_served", "lane_lat_p50_ms", "lane_lat_p99_ms"]
+
+def csv_row(res: dict, fields: List[str] = CSV_FIELDS) -> str:
+    return ",".join(f"{res[k]:.6f}" if isinstance(res[k], float) else str(res[k]) for k in fields)
+
 def print_summary(res: dict):
     print("\n=== RESULTADOS ===")
-    print(f"Buffer: {res['buffer']} | Produtores: {res['P']} | Consumidores: {res['C']} | Duração: {res['duration_s']}s")
-    print(f"Prod sleep (ms): [{res['pmin_ms']}, {res['pmax_ms']}], Cons sleep (ms): [{res['cmin_ms']}, {res['cmax_ms']}]")
+    print(f"Buffer: {res['buffer']} ({res['impl']}, engine {res['engine']}) | Produtores: {res['P']} | Consumidores: {res['C']} | Duração: {res['duration_s']}s")
+    if res["saturate"]:
+        print(f"Saturação: sem sleeps, itens pré-gerados, CPU sintética {res['work']} voltas/item")
+    else:
+        print(f"Prod sleep (ms): [{res['pmin_ms']}, {res['pmax_ms']}], Cons sleep (ms): [{res['cmin_ms']}, {res['cmax_ms']}]")
     print(f"Itens produzidos:  {res['produced']}")
     print(f"Itens consumidos:  {res['consumed']}")
     print(f"Tempo total:       {res['elapsed_s']:.3f}s")
-    print(f"Throughput:        {res['throughput']:.2f} itens/s")
-    print(f"Espera média Prod: {res['avg_p_wait_ms']:.3f} ms/item")
-    print(f"Espera média Cons: {res['avg_c_wait_ms']:.3f} ms/item")
-    print("\nCSV,buffer,P,C,duration_s,pmin_ms,pmax_ms,cmin_ms,cmax_ms,produced,consumed,elapsed_s,throughput,avg_p_wait_ms,avg_c_wait_ms")
-    print(f"CSV,{res['buffer']},{res['P']},{res['C']},{res['duration_s']},"
-          f"{res['pmin_ms']},{res['pmax_ms']},{res['cmin_ms']},{res['cmax_ms']},"
-          f"{res['produced']},{res['consumed']},{res['elapsed_s']:.6f},"
-          f"{res['throughput']:.6f},{res['avg_p_wait_ms']:.6f},{res['avg_c_wait_ms']:.6f}")
+    print(f"Throughput:        {res['throughput']:.2f} itens/s ({res['ns_per_item']:.0f} ns/item)")
+    unit = "item" if res["batch"] <= 1 else f"lote (até {res['batch']})"
+    for side, label in (("p", "Prod"), ("c", "Cons")):
+        print(f"Espera {label}:       média {res[f'avg_{side}_wait_ms']:.3f} | "
+              + " | ".join(f"p{q} {res[f'{side}_wait_p{q}_ms']:.3f}" for q in WAIT_PERCENTILES)
+              + f" ms/{unit}")
+    if res["batch"] > 1:
+        print(f"Itens por get:     {res['avg_c_batch']:.2f}")
+    if res["lane_caps"] != "-":
+        print(f"Faixas ({res['lane_policy']}):")
+        for i, (cap, n, p50, p99) in enumerate(zip(*(res[k].split("|") for k in
+                                                     ("lane_caps", "lane_served", "lane_lat_p50_ms", "lane_lat_p99_ms")))):
+            print(f"  faixa {i}: cap {cap} | {n} itens | na fila p50 {p50} ms | p99 {p99} ms")
+    print(f"Trocas de contexto: {res['ctx_vol']} voluntárias | {res['ctx_invol']} involuntárias (processo inteiro)")
+    print(f"Encerramento:      {res['shutdown']} em {res['shutdown_ms']:.3f} ms | "
+          f"não drenados: {res['undrained']} | threads além do prazo: {res['stragglers']}")
+    if res["stragglers"] == 0:
+        # toda thread saiu: cada item produzido foi consumido ou ficou no buffer
+        assert res["produced"] == res["consumed"] + res["undrained"], "Itens perdidos no encerramento"
+    print("\nCSV," + ",".join(CSV_FIELDS))
+    print("CSV," + csv_row(res))
+
+# ----------------------------
+# Varredura: grade × repetições, em processos
+# ----------------------------
+CONFIG_FIELDS = ["buffer", "engine", "impl", "batch", "P", "C", "duration_s",
+                 "pmin_ms", "pmax_ms", "cmin_ms", "cmax_ms", "shutdown", "saturate", "work",
+                 "lane_caps", "lane_policy"]
+AGG_METRICS = ["throughput", "ns_per_item", "ctx_vol", "ctx_invol", "avg_p_wait_ms", "avg_c_wait_ms", "p_wait_p99_ms", "c_wait_p99_ms",
+               "shutdown_ms", "undrained"]
+# t de Student bicaudal 95% por graus de liberdade (acima de 30 → normal)
+T95 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262,
+       10: 2.228, 12: 2.179, 15: 2.131, 20: 2.086, 25: 2.060, 30: 2.042}
+
+def ci95(xs: List[float]) -> Tuple[float, float]:
+    """(média, meia-largura do IC 95%); uma amostra só → meia-largura 0."""
+    mean = statistics.fmean(xs)
+    if len(xs) < 2:
+        return mean, 0.0
+    df = len(xs) - 1
+    t = T95[max(k for k in T95 if k <= df)] if df <= 30 else 1.96
+    return mean, t * statistics.stdev(xs) / len(xs) ** 0.5
+
+def parse_ranges(spec: str, lo: int, hi: int) -> List[Tuple[int, int]]:
+    """'1-5,0-1' → [(1, 5), (0, 1)]; vazio → [(lo, hi)]."""
+    out = []
+    for part in (x.strip() for x in spec.split(",")):
+        if part:
+            a, _, b = part.partition("-")
+            a = int(a)
+            b = int(b) if b else a
+            out.append((a, max(a, b)))
+    return out or [(lo, hi)]
+
+def run_trial(kw: dict) -> dict:
+    # ponto de entrada do processo filho: uma repetição isolada (GIL próprio)
+    return run_once(**kw)
+
+def run_sweep(configs: List[dict], trials: int, jobs: int) -> List[Tuple[dict, List[dict]]]:
+    """
+    Roda cada configuração `trials` vezes. jobs > 1: repetições em processos
+    separados (concorrentes entre si; use jobs ≤ núcleos para não medir disputa
+    de CPU). Devolve [(config, [res por repetição])] na ordem da grade.
+    """
+    tasks = [(ci, t, dict(cfg, seed=t * 100_003)) for ci, cfg in enumerate(configs) for t in range(trials)]
+    results: Dict[int, List[Tuple[int, dict]]] = {}
+    if jobs <= 1:
+        for ci, t, kw in tasks:
+            results.setdefault(ci, []).append((t, run_trial(kw)))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as ex:
+            futs = {ex.submit(run_trial, kw): (ci, t) for ci, t, kw in tasks}
+            for f in as_completed(futs):
+                ci, t = futs[f]
+                results.setdefault(ci, []).append((t, f.result()))
+    return [(cfg, [r for _, r in sorted(results[ci], key=lambda x: x[0])]) for ci, cfg in enumerate(configs)]
+
+def aggregate(runs: List[dict]) -> dict:
+    row = {k: runs[0][k] for k in CONFIG_FIELDS}
+    row["trials"] = len(runs)
+    for m in AGG_METRICS:
+        row[f"{m}_mean"], row[f"{m}_ci95"] = ci95([float(r[m]) for r in runs])
+    return row
+
+AGG_FIELDS = CONFIG_FIELDS + ["trials"] + [f"{m}_{s}" for m in AGG_METRICS for s in ("mean", "ci95")]
+
+def write_sweep(out: str, done: List[Tuple[dict, List[dict]]], trials: int):
+    """CSV (uma linha por repetição se trials=1, senão média ± IC por configuração) ou JSON (ambos)."""
+    if out.endswith(".json"):
+        doc = {"configs": [aggregate(runs) for _, runs in done],
+               "trials": [dict(r, trial=t) for _, runs in done for t, r in enumerate(runs)]}
+        with open(out, "w") as f:
+            json.dump(doc, f, indent=2)
+        return
+    if trials > 1:
+        fields, rows = AGG_FIELDS, [aggregate(runs) for _, runs in done]
+    else:
+        fields, rows = CSV_FIELDS, [runs[0] for _, runs in done]
+    lines = [",".join(fields)] + [csv_row(r, fields) for r in rows]
+    if out:
+        with open(out, "w") as f:
+            f.write("\n".join(lines) + "\n")
+    else:
+        print("\n".join(lines))
 
 def main():
-    ap = argparse.ArgumentParser(description="Produtores/Consumidores com buffer circular (Python + threading)")
-    ap.add_argument("-b", "--buffer", type=int, default=8, help="Tamanho do buffer")
-    ap.add_argument("-P", "--producers", type=int, default=2, help="Número de produtores")
-    ap.add_argument("-C", "--consumers", type=int, default=2, help="Número de consumidores")
+    ap = argparse.ArgumentParser(description="Produtores/Consumidores com buffer circular (Python + threading/asyncio)")
+    ap.add_argument("-b", "--buffer", type=int, default=None, help="Tamanho do buffer (padrão 8; com --lane-caps, a soma das faixas)")
+    ap.add_argument("-P", "--producers", type=str, default="2", help="Número de produtores. Lista ex: 10,100 → varre no --sweep")
+    ap.add_argument("-C", "--consumers", type=str, default="2", help="Número de consumidores. Lista ex: 10,100 → varre no --sweep")
     ap.add_argument("-d", "--duration", type=int, default=10, help="Duração do experimento (s)")
     ap.add_argument("--pmin", type=int, default=1, help="Sleep mínimo do produtor (ms)")
     ap.add_argument("--pmax", type=int, default=5, help="Sleep máximo do produtor (ms)")
     ap.add_argument("--cmin", type=int, default=1, help="Sleep mínimo do consumidor (ms)")
     ap.add_argument("--cmax", type=int, default=5, help="Sleep máximo do consumidor (ms)")
     ap.add_argument("--sweep", type=str, default="", help="Lista de tamanhos de buffer, ex: 1,2,4,8,16")
+    ap.add_argument("--impl", type=str, default="sem",
+                    help="sem: semáforos+lock+deque | ring: anel pré-alocado (sem trava no lado com 1 thread) | "
+                         "mpmc: anel com trava por lado | lanes: faixas de prioridade. Lista ex: sem,ring → varre no --sweep")
+    ap.add_argument("--batch", type=str, default="1",
+                    help="Itens por put_many/get_many (1 = put/get unitários). Lista ex: 1,8,32 → varre no --sweep")
+    ap.add_argument("--shutdown", choices=SHUTDOWN_MODES, default="drain",
+                    help="drain: consumidores esvaziam o buffer antes de sair | abort: saem já, sobra fica não drenada")
+    ap.add_argument("--shutdown-timeout", type=float, default=5.0, help="Prazo para as threads saírem após o close (s)")
+    ap.add_argument("--engine", type=str, default="thread",
+                    help="thread: uma thread do SO por produtor/consumidor | asyncio: corrotinas numa thread. "
+                         "Lista ex: thread,asyncio → varre no --sweep")
+    ap.add_argument("--psleep", type=str, default="",
+                    help="Faixas de sleep do produtor (ms) para a grade, ex: 1-5,0-1 (padrão: --pmin/--pmax)")
+    ap.add_argument("--csleep", type=str, default="",
+                    help="Faixas de sleep do consumidor (ms) para a grade, ex: 1-5,0-1 (padrão: --cmin/--cmax)")
+    ap.add_argument("--trials", type=int, default=1, help="Repetições por configuração (média e IC 95%%)")
+    ap.add_argument("--jobs", type=int, default=1, help="Repetições simultâneas, cada uma num processo")
+    ap.add_argument("--saturate", action="store_true",
+                    help="Sem sleeps: itens pré-gerados, mede o custo do buffer (itens/s, ns/item, trocas de contexto)")
+    ap.add_argument("--work", type=int, default=0, help="Com --saturate: voltas de CPU sintética por item (produtor e consumidor)")
+    ap.add_argument("--lane-caps", type=str, default="",
+                    help="impl lanes: capacidade por faixa, urgente primeiro, ex: 4,28 (padrão: 1/4 de -b urgente, resto bulk)")
+    ap.add_argument("--lane-mix", type=str, default="0.1",
+                    help="impl lanes: fração dos itens em cada faixa menos a última, ex: 0.1 (10%% urgentes); faltando, o resto é dividido igualmente")
+    ap.add_argument("--lane-policy", choices=LANE_POLICIES, default="strict",
+                    help="impl lanes: strict (sempre a faixa mais urgente) | weighted (round-robin ponderado)")
+    ap.add_argument("--lane-weights", type=str, default="", help="impl lanes, weighted: peso por faixa, ex: 4,1")
+    ap.add_argument("--out", type=str, default="", help="Arquivo de saída da varredura (.csv ou .json; padrão: stdout CSV)")
     args = ap.parse_args()
 
+    engines = [x.strip() for x in args.engine.split(",") if x.strip()] or ["thread"]
+    for e in engines:
+        if e not in ENGINES:
+            raise SystemExit(f"--engine inválido: {e} (use {', '.join(ENGINES)})")
+    p_list = [max(1, int(x)) for x in args.producers.split(",") if x.strip()] or [1]
+    c_list = [max(1, int(x)) for x in args.consumers.split(",") if x.strip()] or [1]
+    batches = [max(1, int(x)) for x in args.batch.split(",") if x.strip()] or [1]
+    impls = [x.strip() for x in args.impl.split(",") if x.strip()] or ["sem"]
+    for im in impls:
+        if im not in IMPLS:
+            raise SystemExit(f"--impl inválido: {im} (use {', '.join(IMPLS)})")
+
     # sanity
     if args.pmax < args.pmin: args.pmax = args.pmin
     if args.cmax < args.cmin: args.cmax = args.cmin
+    if args.buffer is None:
+        lane_caps = [max(1, int(x)) for x in args.lane_caps.split(",") if x.strip()]
+        args.buffer = sum(lane_caps) if "lanes" in impls and lane_caps else 8
     if args.buffer <= 0: args.buffer = 1
-    if args.producers <= 0: args.producers = 1
-    if args.consumers <= 0: args.consumers = 1
     if args.duration <= 0: args.duration = 5
 
-    if args.sweep.strip():
-        sizes = [int(x) for x in args.sweep.split(",") if x.strip()]
-        print("buffer,P,C,duration_s,pmin_ms,pmax_ms,cmin_ms,cmax_ms,produced,consumed,elapsed_s,throughput,avg_p_wait_ms,avg_c_wait_ms")
+    lane_kw = dict(lane_caps=args.lane_caps, lane_mix=args.lane_mix,
+                   lane_policy=args.lane_policy, lane_weights=args.lane_weights)
+    sizes = [max(1, int(x)) for x in args.sweep.split(",") if x.strip()] or [args.buffer]
+    if "lanes" in impls and engines != ["asyncio"]:
         for b in sizes:
-            res = run_once(
-                buffer_cap=max(1, b),
-                P=args.producers, C=args.consumers,
-                duration_s=args.duration,
-                pmin=args.pmin, pmax=args.pmax,
-                cmin=args.cmin, cmax=args.cmax
-            )
-            print(f"{res['buffer']},{res['P']},{res['C']},{res['duration_s']},"
-                  f"{res['pmin_ms']},{res['pmax_ms']},{res['cmin_ms']},{res['cmax_ms']},"
-                  f"{res['produced']},{res['consumed']},{res['elapsed_s']:.6f},"
-                  f"{res['throughput']:.6f},{res['avg_p_wait_ms']:.6f},{res['avg_c_wait_ms']:.6f}")
+            lane_config(b, args.lane_caps, args.lane_mix, args.lane_weights)  # valida antes de rodar
+    p_ranges = parse_ranges(args.psleep, args.pmin, args.pmax)
+    c_ranges = parse_ranges(args.csleep, args.cmin, args.cmax)
+    trials = max(1, args.trials)
+    grid = list(itertools.product(sizes, p_list, c_list, p_ranges, c_ranges, engines, impls, batches))
+
+    if args.sweep.strip() or len(grid) > 1 or trials > 1 or args.out:
+        configs, seen = [], set()
+        for b, P, C, (pl, ph), (cl, chi), e, im, bt in grid:
+            if e == "asyncio":
+                # a engine asyncio tem um buffer só: não repete a mesma execução por impl
+                key = (b, P, C, pl, ph, cl, chi, bt)
+                if key in seen:
+                    continue
+                seen.add(key)
+            configs.append(dict(buffer_cap=b, P=P, C=C, duration_s=args.duration,
+                                pmin=pl, pmax=ph, cmin=cl, cmax=chi, impl=im, batch=bt,
+                                shutdown=args.shutdown, shutdown_timeout=args.shutdown_timeout, engine=e,
+                                saturate=args.saturate, work=max(0, args.work), **lane_kw))
+        done = run_sweep(configs, trials, args.jobs)
+        write_sweep(args.out, done, trials)
+        if args.out:
+            print(f"{len(configs)} configurações × {trials} repetições → {args.out}")
     else:
         res = run_once(
             buffer_cap=args.buffer,
-            P=args.producers, C=args.consumers,
+            P=p_list[0], C=c_list[0],
             duration_s=args.duration,
             pmin=args.pmin, pmax=args.pmax,
-            cmin=args.cmin, cmax=args.cmax
+            cmin=args.cmin, cmax=args.cmax,
+            impl=impls[0], batch=batches[0],
+            shutdown=args.shutdown, shutdown_timeout=args.shutdown_timeout,
+            engine=engines[0], saturate=args.saturate, work=max(0, args.work), **lane_kw
         )
         print_summary(res)
 
@@ -5,54 +5,439 @@
     # SEM trava (incorreto, para evidenciar corridas)
         # python ex03.py -m 32 -t 8 -n 200000 -i 1000 --nolock
 
+    # Travas listradas (N travas para M contas) e varredura de N (CSV)
+        # python ex03.py -m 1000000 -t 8 -n 200000 --stripes 64
+        # python ex03.py -m 1000000 -t 8 -n 200000 --stripes 1,4,16,64,256
+
+    # Auditor sem stop-the-world (seqlock por thread escritora) vs. travar tudo vs. sem auditor
+        # python ex03.py -m 1000000 -t 8 -n 200000 --audit-ms 5 --audit-mode none,lock,seqlock
+
+    # Transferências em lote (um conjunto mínimo de travas por lote) e engine de processos
+        # python ex03.py -m 100000 -t 8 -n 200000 --batch 1,16,128
+        # python ex03.py -m 100000 -t 8 -n 200000 --engine thread,process --batch 1,64
+
+    # Latência por transferência (espera pela trava e seção crítica): p50/p99/p99.9/max
+        # python ex03.py -m 32 -t 8 -n 200000 --latency --latency-csv lat.csv
+        # python ex03.py -m 32 -t 8 -n 200000 --latency --latency-sample 1   (todas as transferências; mais caro)
+
+    # Modo otimista (versões + commit validado, retries com backoff) vs travas, uniforme vs Zipf
+        # python ex03.py -m 1000 -t 8 -n 100000 --mode lock,stm --dist uniform,zipf:1.2
+
+    # Carga concentrada (uniform | zipf:S | hotspot:F:P) pré-gerada; varredura dist × T em CSV
+        # python ex03.py -m 100000 -n 100000 --dist hotspot:0.001:0.9
+        # python ex03.py -m 100000 -n 100000 -t 1,2,4,8 --dist uniform,zipf:1.1,hotspot:0.001:0.9 --sweep
+        # python ex03.py -m 100000 -n 100000 -t 1,2,4,8 --dist uniform,zipf:1.1,hotspot:0.001:0.9 --sweep --latency
+
 # -*- coding: utf-8 -*-
-import argparse, random, threading as th, time
-from typing import List
+import argparse, csv, itertools, multiprocessing as mp, random, threading as th, time
+from array import array
+from typing import List, Optional, Sequence, Tuple
+
+MODES = ("lock", "nolock", "stm")
+MODE_LABELS = {"lock": "COM TRAVA", "nolock": "SEM TRAVA", "stm": "OTIMISTA"}
+AUDIT_MODES = ("lock", "seqlock", "none")
+ENGINES = ("thread", "process")
+MP_DEFAULT_SHARDS = 256  # engine process: cada shard é um semáforo do SO, então não dá 1 por conta
+SEQLOCK_RETRIES = 100  # tentativas otimistas antes de cair no snapshot com todas as travas
+LAT_FLUSH = 1 << 20    # amostras brutas por thread antes de dobrar no histograma (8 B cada)
+LAT_SAMPLE = 64        # com --latency, só 1 a cada LAT_SAMPLE transferências (ou lotes) lê o relógio
+STM_RETRIES = 16       # tentativas otimistas por transferência antes do caminho com travas
+STM_BACKOFF_S = 20e-6  # base do backoff exponencial (com jitter) entre tentativas
+STM_BACKOFF_MAX_S = 1e-3
+DISTS = ("uniform", "zipf", "hotspot")
+
+_now_ns = time.perf_counter_ns
+
+class LogHistogram:
+    """
+    Histograma log-bucketed estilo HDR (valores inteiros ≥ 0, aqui em ns):
+    valores < 16 têm bucket exato; acima disso, 16 sub-buckets por potência de 2
+    (erro relativo ≤ 1/16). record() é O(1) e não aloca.
+    Os contadores podem morar numa list (threads) ou num trecho de RawArray (processos).
+    """
+    SUB_BITS = 4
+    SUB = 1 << SUB_BITS
+    NBUCKETS = SUB + 60 * SUB  # cobre até 2^64
+    SIZE = NBUCKETS + 1        # último slot guarda o máximo exato
+    __slots__ = ("a", "o")
+
+    def __init__(self, arr=None, offset: int = 0):
+        self.a = arr if arr is not None else [0] * self.SIZE
+        self.o = offset
+
+    def record(self, v: int):
+        if v < 16:
+            i = v if v > 0 else 0
+        else:
+            e = v.bit_length() - 5
+            i = 16 + (e << 4) + (v >> e) - 16
+        a, o = self.a, self.o
+        a[o + i] += 1
+        if v > a[o + self.NBUCKETS]:
+            a[o + self.NBUCKETS] = v
+
+    @classmethod
+    def bucket_bounds(cls, i: int) -> Tuple[int, int]:
+        """[lo, hi) dos valores que caem no bucket i."""
+        if i < cls.SUB:
+            return i, i + 1
+        e = (i - cls.SUB) >> cls.SUB_BITS
+        m = cls.SUB + ((i - cls.SUB) & (cls.SUB - 1))
+        return m << e, (m + 1) << e
+
+    def counts(self) -> List[int]:
+        return list(self.a[self.o:self.o + self.NBUCKETS])
+
+    @property
+    def max(self) -> int:
+        return self.a[self.o + self.NBUCKETS]
+
+    def merge(self, other: "LogHistogram"):
+        a, o = self.a, self.o
+        for i, c in enumerate(other.counts()):
+            if c:
+                a[o + i] += c
+        if other.max > self.max:
+            a[o + self.NBUCKETS] = other.max
+
+    def total(self) -> int:
+        return sum(self.counts())
+
+    def approx_sum(self) -> float:
+        """Soma aproximada dos valores (ponto médio de cada bucket)."""
+        acc = 0.0
+        for i, c in enumerate(self.counts()):
+            if c:
+                lo, hi = self.bucket_bounds(i)
+                acc += c * (lo + hi - 1) / 2.0
+        return acc
+
+    def percentile(self, p: float) -> int:
+        """Limite superior do bucket que contém o p-ésimo percentil (nunca acima do máximo)."""
+        n = self.total()
+        if n == 0:
+            return 0
+        rank = max(1, int(round(p / 100.0 * n)))
+        acc = 0
+        for i, c in enumerate(self.counts()):
+            acc += c
+            if acc >= rank:
+                return min(self.bucket_bounds(i)[1] - 1, self.max)
+        return self.max
+
+class LatencyRecorder:
+    """
+    Lado "quente" da medição de latência: o caminho da transferência só faz
+    array.append do delta em ns (C, sem alocar objeto); o bucketing no
+    LogHistogram acontece em flush(), fora da janela medida (ou a cada LAT_FLUSH amostras).
+    Amostragem: run_transfers só entrega o recorder a 1 de cada `every` operações;
+    as demais não leem o relógio. Com every > 1, percentis e máximo são estimativas da amostra.
+    """
+    __slots__ = ("wait_raw", "cs_raw", "wait_h", "cs_h", "every")
+
+    def __init__(self, wait_h: LogHistogram, cs_h: LogHistogram, every: int = 1):
+        self.wait_raw = array("q")
+        self.cs_raw = array("q")
+        self.wait_h = wait_h
+        self.cs_h = cs_h
+        self.every = max(1, every)
+
+    def add(self, wait_ns: int, cs_ns: int):
+        self.wait_raw.append(wait_ns)
+        self.cs_raw.append(cs_ns)
+        if len(self.wait_raw) >= LAT_FLUSH:
+            self.flush()
+
+    def flush(self):
+        for raw, h in ((self.wait_raw, self.wait_h), (self.cs_raw, self.cs_h)):
+            rec = h.record
+            for v in raw:
+                rec(v)
+            del raw[:]
+
+class ThreadStats:
+    """Contadores de UMA thread (único escritor → sem lock); o Bank agrega na leitura.
+    seq é o contador estilo seqlock da thread: ímpar enquanto ela altera saldos.
+    aborts/fallbacks: tentativas otimistas descartadas e transferências que caíram nas travas (modo stm).
+    lat: espera pela trava e seção crítica por transferência amostrada (só com --latency)."""
+    __slots__ = ("ok", "skipped", "seq", "aborts", "fallbacks", "lat")
+
+    def __init__(self, latency: bool = False, lat_sample: int = LAT_SAMPLE):
+        self.ok = 0
+        self.skipped = 0
+        self.seq = 0
+        self.aborts = 0
+        self.fallbacks = 0
+        self.lat: Optional[LatencyRecorder] = (
+            LatencyRecorder(LogHistogram(), LogHistogram(), lat_sample) if latency else None)
+
+def _shared_field(k: int):
+    return property(lambda self: self._a[self._o + k],
+                    lambda self, v: self._a.__setitem__(self._o + k, v))
+
+class SharedThreadStats:
+    """ThreadStats em memória compartilhada (engine process): slot idx de um RawArray
+    com um campo por contador, escrito só pelo processo dono e lido pelo pai."""
+    FIELDS = ("ok", "skipped", "seq", "aborts", "fallbacks")
+    __slots__ = ("_a", "_o", "lat")
+    ok = _shared_field(0)
+    skipped = _shared_field(1)
+    seq = _shared_field(2)
+    aborts = _shared_field(3)
+    fallbacks = _shared_field(4)
+
+    def __init__(self, arr, idx: int, hist_arr=None, lat_sample: int = LAT_SAMPLE):
+        self._a = arr
+        self._o = len(self.FIELDS) * idx
+        self.lat = None
+        if hist_arr is not None:
+            self.lat = LatencyRecorder(LogHistogram(hist_arr, 2 * idx * LogHistogram.SIZE),
+                                       LogHistogram(hist_arr, (2 * idx + 1) * LogHistogram.SIZE), lat_sample)
 
 class Bank:
-    def __init__(self, m: int, init_per_ac: int, use_lock: bool):
+    def __init__(self, m: int, init_per_ac: int, use_lock: bool, stripes: int = 0,
+                 audit_mode: str = "lock", engine: str = "thread", workers: int = 0,
+                 latency: bool = False, optimistic: bool = False, lat_sample: int = LAT_SAMPLE):
         self.m = m
-        self.bal: List[int] = [init_per_ac for _ in range(m)]
-        self.locks: List[th.Lock] = [th.Lock() for _ in range(m)]
-        self.metrics_lock = th.Lock()
+        self.engine = engine
+        if engine == "process":
+            # saldos, travas de shard e contadores por processo em memória compartilhada;
+            # a conta i pertence ao shard i % stripes
+            self.bal = mp.RawArray("q", [init_per_ac] * m)
+            self.ver = mp.RawArray("q", m) if optimistic else None
+            self.stripes = stripes if 0 < stripes <= m else min(m, MP_DEFAULT_SHARDS)
+            self.locks = [mp.Lock() for _ in range(self.stripes)]
+        else:
+            self.bal: List[int] = [init_per_ac for _ in range(m)]
+            # versão por conta (modo stm): incrementada a cada escrita confirmada
+            self.ver: Optional[List[int]] = [0] * m if optimistic else None
+            # trava listrada: a conta i usa locks[i % stripes] (stripes=0 → uma trava por conta)
+            self.stripes = stripes if 0 < stripes <= m else m
+            self.locks: List[th.Lock] = [th.Lock() for _ in range(self.stripes)]
+        self.metrics_lock = th.Lock()  # só para registrar contadores de thread (fora do caminho quente)
         self.use_lock = use_lock
+        self.optimistic = use_lock and optimistic
+        self.audit_mode = audit_mode
+        self.versioned = use_lock and audit_mode == "seqlock"  # escritores publicam seq
+        self.latency = latency
+        self.lat_sample = max(1, lat_sample)
         self.total_initial = sum(self.bal)
         self.running = True
         # métricas
-        self.transfers_ok = 0
-        self.transfers_skipped = 0
+        self.thread_stats: List[ThreadStats] = []
+        if engine == "process":
+            shared = mp.RawArray("q", len(SharedThreadStats.FIELDS) * workers)
+            hists = mp.RawArray("q", 2 * LogHistogram.SIZE * workers) if latency else None
+            self.thread_stats = [SharedThreadStats(shared, i, hists, self.lat_sample) for i in range(workers)]
         self.audit_divergences = 0
         self.audit_checks = 0
+        self.audit_time_s = 0.0
+        self.snap_retries = 0
+        self.snap_fallbacks = 0
+
+    def __getstate__(self):
+        # engine process com "spawn": o filho recebe os objetos compartilhados, não o lock de métricas
+        state = self.__dict__.copy()
+        del state["metrics_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.metrics_lock = th.Lock()
+
+    def new_thread_stats(self) -> ThreadStats:
+        st = ThreadStats(self.latency, self.lat_sample)
+        with self.metrics_lock:
+            self.thread_stats.append(st)
+        return st
+
+    @property
+    def transfers_ok(self) -> int:
+        return sum(st.ok for st in self.thread_stats)
+
+    @property
+    def transfers_skipped(self) -> int:
+        return sum(st.skipped for st in self.thread_stats)
 
-    # snapshot consistente (trava todas as contas em ordem)
+    @property
+    def stm_aborts(self) -> int:
+        return sum(st.aborts for st in self.thread_stats)
+
+    @property
+    def stm_fallbacks(self) -> int:
+        return sum(st.fallbacks for st in self.thread_stats)
+
+    def merged_latency(self) -> Tuple[LogHistogram, LogHistogram]:
+        """(espera, seção crítica) somando os histogramas de todas as threads."""
+        wait, cs = LogHistogram(), LogHistogram()
+        for st in self.thread_stats:
+            if st.lat is not None:
+                st.lat.flush()
+                wait.merge(st.lat.wait_h)
+                cs.merge(st.lat.cs_h)
+        return wait, cs
+
+    def lock_all(self):
+        for L in self.locks:
+            L.acquire()
+
+    def unlock_all(self):
+        for L in reversed(self.locks):
+            L.release()
+
+    # snapshot consistente (trava todas as listras em ordem)
     def _sum_balances_locked(self) -> int:
-        for i in range(self.m):
-            self.locks[i].acquire()
+        self.lock_all()
         try:
             return sum(self.bal)
         finally:
-            for i in reversed(range(self.m)):
-                self.locks[i].release()
+            self.unlock_all()
+
+    # snapshot otimista: nenhuma trava de conta é tocada
+    def _sum_balances_seqlock(self) -> int:
+        """
+        Cada escritor deixa seu seq ímpar só durante a alteração dos dois saldos.
+        Lê os seq (O(T)), soma os saldos e relê os seq: se todos estavam pares e
+        nada mudou, nenhuma transferência estava pela metade → soma consistente.
+        sum(list) roda inteiro em C, sem troca de thread no meio (GIL).
+        """
+        stats = self.thread_stats
+        for _ in range(SEQLOCK_RETRIES):
+            v1 = [st.seq for st in stats]
+            if not any(v & 1 for v in v1):
+                total = sum(self.bal)
+                if [st.seq for st in stats] == v1:
+                    return total
+            self.snap_retries += 1
+            time.sleep(0)  # cede a vez para o escritor no meio da transferência terminar
+        self.snap_fallbacks += 1
+        return self._sum_balances_locked()
 
     def sum_balances(self) -> int:
-        return self._sum_balances_locked() if self.use_lock else sum(self.bal)
+        if not self.use_lock:
+            return sum(self.bal)
+        if self.versioned:
+            return self._sum_balances_seqlock()
+        return self._sum_balances_locked()
+
+    def _transfer_stm(self, src: int, dst: int, amount: int, st: ThreadStats,
+                      lat: Optional[LatencyRecorder] = None):
+        """
+        Controle otimista: lê versões e saldos SEM travas, calcula o resultado e só
+        então tenta confirmar com acquire não-bloqueante das listras; confirma se
+        nenhuma das duas versões mudou. Conflito (versão mudou ou trava ocupada)
+        → abort + backoff exponencial. Após STM_RETRIES, cai no caminho com travas
+        bloqueantes (progresso garantido), que também incrementa as versões.
+        """
+        bal, ver = self.bal, self.ver
+        a, b = src % self.stripes, dst % self.stripes
+        if a > b:
+            a, b = b, a
+        L1 = self.locks[a]
+        L2 = self.locks[b] if b != a else None
+        t0 = _now_ns() if lat is not None else 0  # "espera" = tentativas descartadas até o commit
+        for attempt in range(STM_RETRIES):
+            v_src, v_dst = ver[src], ver[dst]
+            b_src, b_dst = bal[src], bal[dst]
+            ok = b_src >= amount
+            if L1.acquire(False):
+                if L2 is None or L2.acquire(False):
+                    t1 = _now_ns() if lat is not None else 0
+                    committed = False
+                    try:
+                        if ver[src] == v_src and ver[dst] == v_dst:
+                            committed = True
+                            if ok:
+                                if self.versioned:
+                                    st.seq += 1
+                                bal[src] = b_src - amount
+                                bal[dst] = b_dst + amount
+                                ver[src] = v_src + 1
+                                ver[dst] = v_dst + 1
+                                if self.versioned:
+                                    st.seq += 1
+                                st.ok += 1
+                            else:
+                                st.skipped += 1
+                            return
+                    finally:
+                        if L2 is not None:
+                            L2.release()
+                        L1.release()
+                        if committed and lat is not None:
+                            lat.add(t1 - t0, _now_ns() - t1)
+                else:
+                    L1.release()
+            st.aborts += 1
+            if attempt:
+                time.sleep(random.uniform(0.0, min(STM_BACKOFF_MAX_S, STM_BACKOFF_S * (1 << attempt))))
+            else:
+                time.sleep(0)  # 1º conflito: só cede o GIL
+        st.fallbacks += 1
+        L1.acquire()
+        if L2 is not None:
+            L2.acquire()
+        t1 = _now_ns() if lat is not None else 0
+        try:
+            if bal[src] >= amount:
+                if self.versioned:
+                    st.seq += 1
+                bal[src] -= amount
+                bal[dst] += amount
+                ver[src] += 1
+                ver[dst] += 1
+                if self.versioned:
+                    st.seq += 1
+                st.ok += 1
+            else:
+                st.skipped += 1
+        finally:
+            if L2 is not None:
+                L2.release()
+            L1.release()
+            if lat is not None:
+                lat.add(t1 - t0, _now_ns() - t1)
 
-    def transfer(self, src: int, dst: int, amount: int, chaos_sleep: bool):
-        if src == dst: 
+    def transfer(self, src: int, dst: int, amount: int, chaos_sleep: bool, st: ThreadStats,
+                 lat: Optional[LatencyRecorder] = None):
+        """lat: recorder só nas transferências amostradas (None = não lê o relógio)."""
+        if src == dst:
             return
-        if self.use_lock:
-            a, b = (src, dst) if src < dst else (dst, src)
-            L1, L2 = self.locks[a], self.locks[b]
-            with L1:
-                with L2:
-                    if self.bal[src] >= amount:
+        if self.optimistic:
+            self._transfer_stm(src, dst, amount, st, lat)
+        elif self.use_lock:
+            # ordem canônica por índice de listra; mesma listra → uma única trava
+            a, b = src % self.stripes, dst % self.stripes
+            if a > b:
+                a, b = b, a
+            L1 = self.locks[a]
+            L2 = self.locks[b] if b != a else None
+            if lat is not None:
+                t0 = _now_ns()
+            L1.acquire()
+            if L2 is not None:
+                L2.acquire()
+            if lat is not None:
+                t1 = _now_ns()
+            try:
+                if self.bal[src] >= amount:
+                    if self.versioned:
+                        st.seq += 1
                         self.bal[src] -= amount
                         self.bal[dst] += amount
-                        with self.metrics_lock:
-                            self.transfers_ok += 1
+                        st.seq += 1
                     else:
-                        with self.metrics_lock:
-                            self.transfers_skipped += 1
+                        self.bal[src] -= amount
+                        self.bal[dst] += amount
+                    st.ok += 1
+                else:
+                    st.skipped += 1
+            finally:
+                if lat is not None:
+                    lat.add(t1 - t0, _now_ns() - t1)
+                if L2 is not None:
+                    L2.release()
+                L1.release()
         else:
             # sem trava: suscetível a perdas de atualização
             if self.bal[src] >= amount:
@@ -62,27 +447,166 @@ class Bank:
                 if chaos_sleep:
                     time.sleep(random.uniform(0.0, 0.00005))
                 self.bal[dst] += amount
-                with self.metrics_lock:
-                    self.transfers_ok += 1
+                st.ok += 1
             else:
-                with self.metrics_lock:
-                    self.transfers_skipped += 1
-
-def worker_thread(bank: Bank, ops: int, max_amount: int, chaos_sleep: bool):
-    rnd = random.Random(time.time_ns() ^ th.get_ident())
-    m = bank.m
-    for _ in range(ops):
-        src = rnd.randrange(m)
-        dst = rnd.randrange(m)
-        while dst == src:
-            dst = rnd.randrange(m)
-        amount = rnd.randint(1, max_amount)
-        bank.transfer(src, dst, amount, chaos_sleep)
+                st.skipped += 1
+
+    def transfer_batch(self, batch: Sequence[Tuple[int, int, int]], chaos_sleep: bool, st: ThreadStats,
+                       lat: Optional[LatencyRecorder] = None):
+        """
+        Aplica o lote em ordem, com a mesma semântica de transfer() item a item,
+        mas adquirindo uma única vez o conjunto mínimo de listras tocadas
+        (ordenado → mesma ordem canônica, sem deadlock).
+        """
+        if not self.use_lock or self.optimistic:
+            for src, dst, amount in batch:
+                self.transfer(src, dst, amount, chaos_sleep, st, lat)
+            return
+        S = self.stripes
+        idx = sorted({a % S for src, dst, _ in batch for a in (src, dst)})
+        locks = self.locks
+        # no lote, a latência registrada é a do lote inteiro
+        if lat is not None:
+            t0 = _now_ns()
+        for i in idx:
+            locks[i].acquire()
+        if lat is not None:
+            t1 = _now_ns()
+        try:
+            bal = self.bal
+            ok = skipped = 0
+            if self.versioned:
+                st.seq += 1
+            for src, dst, amount in batch:
+                if src == dst:
+                    continue
+                if bal[src] >= amount:
+                    bal[src] -= amount
+                    bal[dst] += amount
+                    ok += 1
+                else:
+                    skipped += 1
+            if self.versioned:
+                st.seq += 1
+            st.ok += ok
+            st.skipped += skipped
+        finally:
+            if lat is not None:
+                lat.add(t1 - t0, _now_ns() - t1)
+            for i in reversed(idx):
+                locks[i].release()
+
+# ----------------------------
+# Carga de trabalho
+# ----------------------------
+def parse_dist(spec: str) -> Tuple[str, Tuple[float, ...]]:
+    """uniform | zipf:S | hotspot:F:P (fração F das contas recebe P dos acessos)."""
+    name, *params = spec.split(":")
+    try:
+        vals = tuple(float(x) for x in params)
+    except ValueError:
+        vals = None
+    if name == "uniform" and vals == ():
+        return name, ()
+    if name == "zipf" and vals is not None and len(vals) <= 1:
+        return name, vals or (1.1,)
+    if name == "hotspot" and vals is not None and len(vals) <= 2:
+        f, hot_p = (vals + (0.01, 0.9)[len(vals):])
+        if 0.0 < f <= 1.0 and 0.0 <= hot_p <= 1.0:
+            return name, (f, hot_p)
+    raise SystemExit(f"--dist inválida: {spec} (use uniform, zipf:S ou hotspot:F:P)")
+
+def account_cdf(m: int, dist: str) -> Optional[List[float]]:
+    """
+    Pesos cumulativos por conta para random.choices (None = uniforme).
+    zipf: a conta k tem peso 1/(k+1)^s. hotspot: as primeiras ceil(F·m) contas
+    dividem P dos acessos e o resto divide 1-P. Contas quentes têm ids baixos,
+    então com i % N elas caem em listras distintas.
+    """
+    name, params = parse_dist(dist)
+    if name == "uniform":
+        return None
+    cdf: List[float] = []
+    if name == "zipf":
+        s = params[0]
+        acc = 0.0
+        for k in range(m):
+            acc += 1.0 / (k + 1) ** s
+            cdf.append(acc)
+        cdf = [c / acc for c in cdf]
+    else:
+        f, hot_p = params
+        h = min(m, max(1, -int(-f * m // 1)))
+        if h == m:
+            return None
+        w_hot, w_cold = hot_p / h, (1.0 - hot_p) / (m - h)
+        cdf = [(k + 1) * w_hot for k in range(h)]
+        cdf += [hot_p + (k + 1) * w_cold for k in range(m - h)]
+    cdf[-1] = 1.0
+    return cdf
+
+class Workload:
+    """
+    Transferências pré-geradas de um worker (arrays de int32): o sorteio das
+    contas — caro com Zipf/hotspot — sai da janela medida e o laço só itera.
+    """
+    __slots__ = ("src", "dst", "amt")
+
+    def __init__(self, m: int, ops: int, max_amount: int, cdf: Optional[List[float]], seed: int):
+        rnd = random.Random(seed)
+        pop = range(m)
+        src = rnd.choices(pop, cum_weights=cdf, k=ops)
+        dst = rnd.choices(pop, cum_weights=cdf, k=ops)
+        for i in range(ops):
+            while dst[i] == src[i]:  # sem auto-transferência (m ≥ 2)
+                dst[i] = rnd.choices(pop, cum_weights=cdf)[0]
+        self.src = array("i", src)
+        self.dst = array("i", dst)
+        self.amt = array("i", rnd.choices(range(1, max_amount + 1), k=ops))
+
+    def __len__(self) -> int:
+        return len(self.src)
+
+def run_transfers(bank: Bank, st: ThreadStats, wl: Workload, chaos_sleep: bool, batch: int = 1):
+    # latência amostrada: a 1ª operação de cada grupo de `every` recebe o recorder,
+    # as outras every-1 passam pelo laço interno sem nenhuma leitura de relógio
+    lat = st.lat
+    every = lat.every if lat is not None else 0
+    if batch <= 1:
+        transfer = bank.transfer
+        it = zip(wl.src, wl.dst, wl.amt)
+        if lat is None:
+            for src, dst, amount in it:
+                transfer(src, dst, amount, chaos_sleep, st)
+            return
+        for src, dst, amount in it:
+            transfer(src, dst, amount, chaos_sleep, st, lat)
+            for src, dst, amount in itertools.islice(it, every - 1):
+                transfer(src, dst, amount, chaos_sleep, st)
+        return
+    items = list(zip(wl.src, wl.dst, wl.amt))
+    for k, i in enumerate(range(0, len(items), batch)):
+        sampled = lat if lat is not None and k % every == 0 else None
+        bank.transfer_batch(items[i:i + batch], chaos_sleep, st, sampled)
+
+def worker_thread(bank: Bank, wl: Workload, chaos_sleep: bool, batch: int = 1):
+    st = bank.new_thread_stats()
+    run_transfers(bank, st, wl, chaos_sleep, batch)
+
+def worker_process(bank: Bank, idx: int, go, wl: Workload, chaos_sleep: bool, batch: int = 1):
+    # mesmo laço das threads; saldos/travas/contadores vivem em memória compartilhada
+    st = bank.thread_stats[idx]
+    go.wait()  # largada conjunta: o tempo medido não inclui subir os processos
+    run_transfers(bank, st, wl, chaos_sleep, batch)
+    if st.lat is not None:
+        st.lat.flush()  # amostras brutas são locais ao processo: publica no histograma compartilhado
 
 def auditor_thread(bank: Bank, period_ms: int):
     while bank.running:
         time.sleep(period_ms / 1000.0)
+        t0 = time.perf_counter()
         total = bank.sum_balances()
+        bank.audit_time_s += time.perf_counter() - t0
         bank.audit_checks += 1
         if bank.use_lock:
             # no modo correto, o invariante deve SEMPRE valer
@@ -94,69 +618,269 @@ def auditor_thread(bank: Bank, period_ms: int):
             if total != bank.total_initial:
                 bank.audit_divergences += 1
 
-def main():
-    ap = argparse.ArgumentParser(description="Contas bancárias com transferências concorrentes (Python threads)")
-    ap.add_argument("-m", "--accounts", type=int, default=32, help="Número de contas M")
-    ap.add_argument("-t", "--threads", type=int, default=8, help="Número de threads T")
-    ap.add_argument("-n", "--ops", type=int, default=200000, help="Operações por thread")
-    ap.add_argument("-i", "--init", type=int, default=1000, help="Saldo inicial por conta")
-    ap.add_argument("--max-amount", type=int, default=10, help="Valor máximo por transferência")
-    ap.add_argument("--audit-ms", type=int, default=20, help="Período do auditor (ms)")
-    ap.add_argument("--nolock", action="store_true", help="Executar sem travas (demonstra corrida)")
-    args = ap.parse_args()
-
-    use_lock = not args.nolock
-    bank = Bank(args.accounts, args.init, use_lock=use_lock)
-
-    print(f"[INFO] M={args.accounts} | T={args.threads} | ops/thread={args.ops} | init/conta={args.init} | "
-          f"{'COM TRAVA' if use_lock else 'SEM TRAVA'}")
+def run_once(accounts: int, threads: int, ops: int, init: int, max_amount: int,
+             audit_ms: int, mode: str = "lock", stripes: int = 0, audit_mode: str = "lock",
+             engine: str = "thread", batch: int = 1, latency: bool = False, dist: str = "uniform",
+             seed: Optional[int] = None, lat_sample: int = LAT_SAMPLE) -> dict:
+    use_lock = mode != "nolock"
+    bank = Bank(accounts, init, use_lock=use_lock, stripes=stripes, audit_mode=audit_mode,
+                engine=engine, workers=threads, latency=latency, optimistic=mode == "stm",
+                lat_sample=lat_sample)
+    # carga pré-gerada antes do cronômetro (mesma seed → mesmas transferências entre configurações)
+    cdf = account_cdf(accounts, dist)
+    base = seed if seed is not None else time.time_ns()
+    loads = [Workload(accounts, ops, max_amount, cdf, base + 7919 * i) for i in range(threads)]
 
-    aud = th.Thread(target=auditor_thread, args=(bank, args.audit_ms), daemon=True)
-    aud.start()
+    aud = None
+    if audit_mode != "none":
+        aud = th.Thread(target=auditor_thread, args=(bank, audit_ms), daemon=True)
+        aud.start()
 
     workers = []
-    start = time.perf_counter()
-    for _ in range(args.threads):
-        w = th.Thread(target=worker_thread,
-                      args=(bank, args.ops, args.max_amount, not use_lock),
-                      daemon=False)
-        workers.append(w)
-        w.start()
-    for w in workers:
-        w.join()
-    elapsed = time.perf_counter() - start
+    if engine == "process":
+        go = mp.Event()
+        for i in range(threads):
+            w = mp.Process(target=worker_process,
+                           args=(bank, i, go, loads[i], not use_lock, batch),
+                           daemon=False)
+            workers.append(w)
+            w.start()
+        start = time.perf_counter()
+        go.set()
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - start
+        failed = [w.exitcode for w in workers if w.exitcode != 0]
+        assert not failed, f"Processo(s) worker falharam: exitcodes={failed}"
+    else:
+        start = time.perf_counter()
+        for i in range(threads):
+            w = th.Thread(target=worker_thread,
+                          args=(bank, loads[i], not use_lock, batch),
+                          daemon=False)
+            workers.append(w)
+            w.start()
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - start
 
     # encerrar auditor e tirar totais finais de forma consistente
     bank.running = False
-    aud.join()
+    if aud is not None:
+        aud.join()
 
     # soma final consistente (trava geral mesmo no modo sem trava)
-    for i in range(bank.m):
-        bank.locks[i].acquire()
+    bank.lock_all()
     total_final = sum(bank.bal)
-    for i in reversed(range(bank.m)):
-        bank.locks[i].release()
+    bank.unlock_all()
+
+    throughput = (threads * ops) / elapsed if elapsed > 0 else 0.0
+    wait_h, cs_h = bank.merged_latency()
+    lat = {}
+    for name, h in (("wait", wait_h), ("cs", cs_h)):
+        for label, p in LAT_PERCENTILES:
+            lat[f"{name}_{label}_us"] = h.percentile(p) / 1e3
+        lat[f"{name}_max_us"] = h.max / 1e3
+    # fração do tempo de parede das T threads gasta esperando travas; só com todas as
+    # operações medidas (escalar a soma da amostra deixa poucos outliers dominarem)
+    wait_share = None
+    if latency and bank.lat_sample == 1:
+        wait_share = wait_h.approx_sum() / 1e9 / (threads * elapsed) if elapsed > 0 else 0.0
+    return {
+        "mode": MODE_LABELS[mode],
+        "use_lock": use_lock,
+        "dist": dist,
+        "M": accounts,
+        "T": threads,
+        "ops": ops,
+        "stripes": bank.stripes,
+        "engine": engine,
+        "batch": batch,
+        "total_initial": bank.total_initial,
+        "total_final": total_final,
+        "elapsed_s": elapsed,
+        "throughput": throughput,
+        "ok": bank.transfers_ok,
+        "skipped": bank.transfers_skipped,
+        "aborts": bank.stm_aborts,
+        "abort_rate": bank.stm_aborts / (bank.stm_aborts + threads * ops) if mode == "stm" else 0.0,
+        "stm_fallbacks": bank.stm_fallbacks,
+        "audit_mode": audit_mode,
+        "audit_divergences": bank.audit_divergences,
+        "audit_checks": bank.audit_checks,
+        "audit_time_s": bank.audit_time_s,
+        "snap_retries": bank.snap_retries,
+        "snap_fallbacks": bank.snap_fallbacks,
+        "latency": latency,
+        "lat_sample": bank.lat_sample,
+        "wait_hist": wait_h,
+        "cs_hist": cs_h,
+        "wait_share": wait_share,
+        **lat,
+    }
+
+LAT_PERCENTILES = (("p50", 50.0), ("p99", 99.0), ("p999", 99.9))
 
-    throughput = (args.threads * args.ops) / elapsed if elapsed > 0 else 0.0
+def dump_latency_csv(path: str, wait_h: LogHistogram, cs_h: LogHistogram):
+    with open(path, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["bucket_lo_ns", "bucket_hi_ns", "wait_count", "cs_count"])
+        for i, (cw, cc) in enumerate(zip(wait_h.counts(), cs_h.counts())):
+            if cw or cc:
+                lo, hi = LogHistogram.bucket_bounds(i)
+                w.writerow([lo, hi, cw, cc])
 
+def print_summary(res: dict):
+    use_lock = res["use_lock"]
     print("\n=== RESULTADOS ===")
-    print(f"Modo:         {'COM TRAVA' if use_lock else 'SEM TRAVA'}")
-    print(f"Total inicial:{bank.total_initial}")
-    print(f"Total final:  {total_final}")
-    print(f"Tempo:        {elapsed:.3f}s")
-    print(f"Throughput:   {throughput:,.0f} ops/s")
-    print(f"OK:           {bank.transfers_ok:,} | Skips (sem saldo): {bank.transfers_skipped:,}")
+    print(f"Modo:         {res['mode']}")
+    print(f"Travas:       {res['stripes']} listra(s) para {res['M']} contas | engine {res['engine']} | lote {res['batch']}")
+    print(f"Total inicial:{res['total_initial']}")
+    print(f"Total final:  {res['total_final']}")
+    print(f"Tempo:        {res['elapsed_s']:.3f}s")
+    print(f"Throughput:   {res['throughput']:,.0f} ops/s")
+    print(f"OK:           {res['ok']:,} | Skips (sem saldo): {res['skipped']:,}")
+    print(f"Contas:       distribuição {res['dist']}")
+    if res["mode"] == MODE_LABELS["stm"]:
+        print(f"Otimista:     {res['aborts']:,} aborts ({100*res['abort_rate']:.2f}% das tentativas) | "
+              f"{res['stm_fallbacks']:,} caíram nas travas")
+    if res["audit_mode"] != "none":
+        checks = res["audit_checks"]
+        print(f"Auditor:      {res['audit_mode']} | {checks} snapshots | "
+              f"{(1e3*res['audit_time_s']/checks if checks else 0):.3f} ms/snapshot"
+              + (f" | retries {res['snap_retries']} | fallbacks {res['snap_fallbacks']}"
+                 if res["audit_mode"] == "seqlock" else ""))
+    if res["latency"] and use_lock:
+        unit = "lote" if res["batch"] > 1 else "transferência"
+        if res["lat_sample"] > 1:
+            print(f"Latência amostrada: 1 a cada {res['lat_sample']} {unit}s "
+                  f"(percentis e max são estimativas da amostra; o max real pode ser maior)")
+        for name, label in (("wait", "Espera trava"), ("cs", "Seção crít.")):
+            print(f"{label:13} (µs/{unit}): p50 {res[name+'_p50_us']:.2f} | p99 {res[name+'_p99_us']:.2f} | "
+                  f"p99.9 {res[name+'_p999_us']:.2f} | max {res[name+'_max_us']:.2f}")
+        if res["wait_share"] is not None:
+            print(f"Espera total: {100*res['wait_share']:.1f}% do tempo das threads")
+        else:
+            print("Espera total: só com --latency-sample 1 (a soma de uma amostra não estima a fração)")
     if use_lock:
-        assert total_final == bank.total_initial, "Invariante falhou no modo COM TRAVA"
+        assert res["total_final"] == res["total_initial"], "Invariante falhou no modo COM TRAVA"
         print("✅ Invariante mantido: soma global constante (assert passou).")
     else:
-        print(f"Divergências observadas pelo auditor: {bank.audit_divergences}/{bank.audit_checks} snapshots "
-              f"({(100*bank.audit_divergences/bank.audit_checks if bank.audit_checks else 0):.1f}%).")
-        if total_final != bank.total_initial:
+        checks = res["audit_checks"]
+        print(f"Divergências observadas pelo auditor: {res['audit_divergences']}/{checks} snapshots "
+              f"({(100*res['audit_divergences']/checks if checks else 0):.1f}%).")
+        if res["total_final"] != res["total_initial"]:
             print("⚠️  Corrida evidenciada: soma final difere da inicial (como esperado SEM TRAVA).")
         else:
             print("ℹ️  Soma final igual nesta execução; aumente -t e -n para ver divergências persistentes.")
 
+CSV_FIELDS = ["mode", "dist", "M", "T", "ops", "stripes", "audit_mode", "engine", "batch", "elapsed_s", "throughput", "ok", "skipped",
+              "aborts", "abort_rate", "stm_fallbacks",
+              "audit_checks", "audit_time_s", "snap_retries", "snap_fallbacks",
+              "lat_sample", "wait_p50_us", "wait_p99_us", "wait_p999_us", "wait_max_us", "wait_share",
+              "cs_p50_us", "cs_p99_us", "cs_p999_us", "cs_max_us", "total_initial", "total_final"]
+
+# --sweep: só o que importa para comparar distribuições × threads
+SWEEP_FIELDS = ["dist", "T", "mode", "stripes", "engine", "throughput", "ok", "skipped", "aborts"]
+# ... e, com --latency, a espera pela trava (medida numa execução à parte do throughput);
+# lat_sample > 1: percentis/max estimados pela amostra e wait_share vazio ("-")
+SWEEP_LAT_FIELDS = ["lat_sample", "wait_p50_us", "wait_p99_us", "wait_p999_us", "wait_max_us", "wait_share"]
+
+def csv_row(res: dict, fields: Sequence[str] = CSV_FIELDS) -> str:
+    return ",".join("-" if res[k] is None else f"{res[k]:.6f}" if isinstance(res[k], float) else str(res[k])
+                    for k in fields)
+
+def main():
+    ap = argparse.ArgumentParser(description="Contas bancárias com transferências concorrentes (Python threads)")
+    ap.add_argument("-m", "--accounts", type=int, default=32, help="Número de contas M")
+    ap.add_argument("-t", "--threads", type=str, default="8", help="Número de threads T. Lista ex: 1,2,4,8 → CSV")
+    ap.add_argument("-n", "--ops", type=int, default=200000, help="Operações por thread")
+    ap.add_argument("-i", "--init", type=int, default=1000, help="Saldo inicial por conta")
+    ap.add_argument("--max-amount", type=int, default=10, help="Valor máximo por transferência")
+    ap.add_argument("--audit-ms", type=int, default=20, help="Período do auditor (ms)")
+    ap.add_argument("--nolock", action="store_true", help="Executar sem travas (demonstra corrida); atalho de --mode nolock")
+    ap.add_argument("--mode", type=str, default="lock",
+                    help="lock: travas ordenadas | nolock: sem travas | stm: otimista com versões. Lista ex: lock,stm → CSV")
+    ap.add_argument("--dist", type=str, default="uniform",
+                    help="Escolha das contas: uniform | zipf:S | hotspot:F:P (fração F das contas recebe P dos acessos). "
+                         "Lista ex: uniform,zipf:1.2,hotspot:0.01:0.9 → CSV")
+    ap.add_argument("--seed", type=int, default=None, help="Semente da carga pré-gerada (padrão: relógio)")
+    ap.add_argument("--sweep", action="store_true",
+                    help="CSV enxuto por dist × T: throughput sem medir latência; com --latency, "
+                         "a espera pela trava vem de uma 2ª execução da mesma carga")
+    ap.add_argument("--stripes", type=str, default="0",
+                    help="Nº de travas (conta i → trava i %% N; 0 = uma por conta). Lista ex: 1,4,16 → CSV por configuração")
+    ap.add_argument("--audit-mode", type=str, default="lock",
+                    help="lock: trava todas as contas | seqlock: snapshot otimista sem travas | none: sem auditor. "
+                         "Lista ex: none,lock,seqlock → CSV por configuração")
+    ap.add_argument("--batch", type=str, default="1",
+                    help="Transferências por lote (transfer_batch; 1 = uma a uma). Lista ex: 1,16,128 → CSV")
+    ap.add_argument("--engine", type=str, default="thread",
+                    help="thread | process (contas em memória compartilhada, shards com mp.Lock). Lista ex: thread,process")
+    ap.add_argument("--latency", action="store_true",
+                    help="Registra espera pela trava e seção crítica por transferência (histograma log por thread)")
+    ap.add_argument("--latency-csv", type=str, default="",
+                    help="Salva o histograma de latência (buckets em ns) em CSV; implica --latency")
+    ap.add_argument("--latency-sample", type=int, default=LAT_SAMPLE,
+                    help=f"Mede 1 a cada N transferências/lotes (padrão {LAT_SAMPLE}; 1 = todas, distorce o throughput)")
+    args = ap.parse_args()
+
+    mode_list = ["nolock"] if args.nolock else ([x.strip() for x in args.mode.split(",") if x.strip()] or ["lock"])
+    for md in mode_list:
+        if md not in MODES:
+            raise SystemExit(f"--mode inválido: {md} (use {', '.join(MODES)})")
+    dist_list = [x.strip() for x in args.dist.split(",") if x.strip()] or ["uniform"]
+    for d in dist_list:
+        parse_dist(d)
+    latency = args.latency or bool(args.latency_csv)
+    threads_list = [max(1, int(x)) for x in args.threads.split(",") if x.strip()] or [8]
+    stripes_list = [int(x) for x in args.stripes.split(",") if x.strip()] or [0]
+    audit_list = [x.strip() for x in args.audit_mode.split(",") if x.strip()] or ["lock"]
+    for a in audit_list:
+        if a not in AUDIT_MODES:
+            raise SystemExit(f"--audit-mode inválido: {a} (use {', '.join(AUDIT_MODES)})")
+    batch_list = [max(1, int(x)) for x in args.batch.split(",") if x.strip()] or [1]
+    engine_list = [x.strip() for x in args.engine.split(",") if x.strip()] or ["thread"]
+    for e in engine_list:
+        if e not in ENGINES:
+            raise SystemExit(f"--engine inválido: {e} (use {', '.join(ENGINES)})")
+
+    grid = list(itertools.product(dist_list, threads_list, mode_list, stripes_list, audit_list,
+                                  engine_list, batch_list))
+    if len(grid) > 1 or args.sweep:
+        fields = CSV_FIELDS
+        if args.sweep:
+            fields = SWEEP_FIELDS + (SWEEP_LAT_FIELDS if latency else [])
+        print(",".join(fields))
+        for d, t, md, s, a, e, b in grid:
+            # na varredura o throughput nunca carrega o custo da medição de latência;
+            # sem --seed, fixa uma semente para as duas execuções verem a mesma carga
+            seed = args.seed if args.seed is not None or not args.sweep else time.time_ns()
+            res = run_once(args.accounts, t, args.ops, args.init, args.max_amount,
+                           args.audit_ms, md, stripes=s, audit_mode=a, engine=e, batch=b,
+                           latency=latency and not args.sweep, dist=d, seed=seed,
+                           lat_sample=args.latency_sample)
+            if args.sweep and latency:
+                lat_res = run_once(args.accounts, t, args.ops, args.init, args.max_amount,
+                                   args.audit_ms, md, stripes=s, audit_mode=a, engine=e, batch=b,
+                                   latency=True, dist=d, seed=seed, lat_sample=args.latency_sample)
+                res.update({k: lat_res[k] for k in SWEEP_LAT_FIELDS})
+            if res["use_lock"]:
+                assert res["total_final"] == res["total_initial"], (
+                    f"Invariante falhou (dist={d}, T={t}, mode={md}, stripes={s}, audit={a}, engine={e}, batch={b})")
+            print(csv_row(res, fields), flush=True)
+        return
+
+    print(f"[INFO] M={args.accounts} | T={threads_list[0]} | ops/thread={args.ops} | init/conta={args.init} | "
+          f"{MODE_LABELS[mode_list[0]]}")
+    res = run_once(args.accounts, threads_list[0], args.ops, args.init, args.max_amount,
+                   args.audit_ms, mode_list[0], stripes=stripes_list[0], audit_mode=audit_list[0],
+                   engine=engine_list[0], batch=batch_list[0], latency=latency, dist=dist_list[0],
+                   seed=args.seed, lat_sample=args.latency_sample)
+    print_summary(res)
+    if args.latency_csv:
+        dump_latency_csv(args.latency_csv, res["wait_hist"], res["cs_hist"])
+        print(f"Histograma de latência salvo em {args.latency_csv}")
+
 if __name__ == "__main__":
     main()
-
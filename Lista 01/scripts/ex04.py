@@ -1,19 +1,75 @@
-#como rodar? 
+#como rodar?
         # python ex04.py -n 1000 -c1 8 -c2 8 --cap-ms 1,4 --proc-ms 2,5 --grav-ms 1,3
 
         # Varie capacidades pequenas para estressar backpressure:
             # python ex04.py -n 1000 -c1 1 -c2 1
 
+        # Escalar só o gargalo (processamento com 4 workers):
+            # python ex04.py -n 1000 -w 1,4,1
+
+        # Pipeline de profundidade arbitrária (nome:workers:ms_min-ms_max) e capacidades entre estágios:
+            # python ex04.py -n 1000 --stages captura:1:1-4,processamento:4:2-5,filtro:2:0-1,gravacao:1:1-3 --caps 8,8,8
+
+        # Processamento paralelo preservando a ordem (reorder buffer com janela de 16 itens):
+            # python ex04.py -n 1000 -w 1,4,1 --ordered --reorder-window 16
+            # python ex04.py -n 1000 --stages captura:1:1-4,processamento:4:2-5:ordered,gravacao:1:1-3
+
+        # Micro-lotes entre estágios: varre tamanho de lote x linger e compara vazão com latência fim a fim
+            # python ex04.py -n 20000 --cap-ms 0,0 --proc-ms 0,0 --grav-ms 0,0 --batch 1,8,32 --linger-ms 0,2
+
+        # Rastro por item: espera na fila x serviço por estágio e exportação para chrome://tracing / Perfetto
+            # python ex04.py -n 500 -w 1,4,1 --trace-out trace.json
+
+        # Processamento CPU-bound em processos (1 por worker), quadros de 256 KB num slab de memória compartilhada:
+            # python ex04.py -n 2000 --cap-ms 0,1 --proc-ms 0,0 --grav-ms 0,1 -w 1,4,1 --work 20000 --proc-stages processamento --frame-kb 256
+            # python ex04.py -n 2000 --stages captura:1:0-1,processamento:4:0-0:proc+work=20000,gravacao:1:0-1 --frame-kb 256
+            # python ex04.py -n 2000 -w 1,4,1 --work 20000 --proc-stages processamento --frame-kb 256 --start-method spawn
+
 # -*- coding: utf-8 -*-
 import argparse
+import json
+import multiprocessing as mp
+import queue
+import struct
 import threading as th
 from collections import deque
+from multiprocessing import shared_memory
 import time, random
+from typing import List, Optional, Tuple
+
+# ==========================
+# Sentinelas
+# ==========================
+class _Sentinel:
+    """Sentinela que atravessa filas entre processos: o pickle devolve a MESMA instância (teste com `is`)."""
+    def __init__(self, name: str):
+        self.name = name
+
+    def __reduce__(self):
+        return (_sentinel, (self.name,))
+
+    def __repr__(self):
+        return self.name
+
+_SENTINELS = {}
+
+def _sentinel(name: str) -> _Sentinel:
+    return _SENTINELS.setdefault(name, _Sentinel(name))
+
+# Devolvido por get(timeout) quando o prazo expira sem item
+EMPTY = _sentinel("EMPTY")
 
 # ==========================
 # Fila limitada: mutex + condição (espera ativa zero)
 # ==========================
+
 class BoundedQueue:
+    """
+    Além de put/get, mede a ocupação média ponderada pelo tempo (área sob len(q)),
+    o pico, quantos puts de dados houve (o POISON do encerramento não conta) e quanto tempo
+    os produtores ficaram bloqueados com a fila cheia.
+    Com micro-lotes cada entrada é uma lista de itens: capacidade e ocupação contam entradas.
+    """
     def __init__(self, capacity: int):
         assert capacity > 0
         self.capacity = capacity
@@ -21,128 +77,861 @@ class BoundedQueue:
         self.lock = th.Lock()
         self.not_empty = th.Condition(self.lock)
         self.not_full  = th.Condition(self.lock)
+        self.t_start = self.t_last = time.perf_counter()
+        self.area = 0.0       # ∫ len(q) dt
+        self.max_len = 0
+        self.put_blocked_s = 0.0
+        self.puts = 0
+
+    def _touch(self):
+        # chamado com o lock, antes de len(q) mudar
+        now = time.perf_counter()
+        self.area += len(self.q) * (now - self.t_last)
+        self.t_last = now
 
     def put(self, item):
         with self.not_full:
-            while len(self.q) >= self.capacity:
-                self.not_full.wait()
+            if len(self.q) >= self.capacity:
+                t0 = time.perf_counter()
+                while len(self.q) >= self.capacity:
+                    self.not_full.wait()
+                self.put_blocked_s += time.perf_counter() - t0
+            self._touch()
             self.q.append(item)
+            if item is not POISON:
+                self.puts += 1
+            if len(self.q) > self.max_len:
+                self.max_len = len(self.q)
             self.not_empty.notify()
 
-    def get(self):
+    def get(self, timeout: Optional[float] = None):
         with self.not_empty:
-            while len(self.q) == 0:
-                self.not_empty.wait()
+            if timeout is None:
+                while len(self.q) == 0:
+                    self.not_empty.wait()
+            elif len(self.q) == 0:
+                deadline = time.perf_counter() + timeout
+                while len(self.q) == 0:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        return EMPTY
+                    self.not_empty.wait(remaining)
+            self._touch()
             item = self.q.popleft()
             self.not_full.notify()
             return item
 
+    def mean_occupancy(self) -> float:
+        with self.lock:
+            self._touch()
+            span = self.t_last - self.t_start
+            return self.area / span if span > 0 else 0.0
+
+    def __len__(self):
+        with self.lock:
+            return len(self.q)
+
+class ProcQueue:
+    """
+    Mesma interface da BoundedQueue para as filas que tocam um estágio em processo:
+    multiprocessing.Queue(maxsize=capacity) faz o backpressure; as métricas ficam
+    num RawArray compartilhado sob mp.Lock. A ocupação é contada depois do put/get
+    (aproximada: o consumidor pode ver o item antes do produtor contabilizá-lo, então
+    o contador é limitado a [0, capacity] — o semáforo da mp.Queue garante esse limite de fato).
+    """
+    # índices no RawArray de métricas
+    LEN, MAX, PUTS, BLOCKED, AREA, T_LAST, T_START = range(7)
+
+    def __init__(self, capacity: int):
+        assert capacity > 0
+        self.capacity = capacity
+        self.q = mp.Queue(maxsize=capacity)
+        self.lock = mp.Lock()
+        self.m = mp.RawArray("d", 7)
+        self.t_start = time.perf_counter()
+
+    @property
+    def t_start(self) -> float:
+        return self.m[self.T_START]
+
+    @t_start.setter
+    def t_start(self, t: float):
+        self.m[self.T_START] = self.m[self.T_LAST] = t
+
+    @property
+    def t_last(self) -> float:
+        return self.m[self.T_LAST]
+
+    @t_last.setter
+    def t_last(self, t: float):
+        self.m[self.T_LAST] = t
+
+    def _account(self, delta: int, blocked: float = 0.0, data: bool = True):
+        m = self.m
+        with self.lock:
+            now = time.perf_counter()
+            m[self.AREA] += min(max(0.0, m[self.LEN]), self.capacity) * (now - m[self.T_LAST])
+            m[self.T_LAST] = now
+            m[self.LEN] += delta
+            if delta > 0:
+                m[self.PUTS] += data
+                m[self.BLOCKED] += blocked
+                if m[self.LEN] > m[self.MAX]:
+                    m[self.MAX] = m[self.LEN]
+
+    def put(self, item):
+        try:
+            self.q.put_nowait(item)
+            blocked = 0.0
+        except queue.Full:
+            t0 = time.perf_counter()
+            self.q.put(item)
+            blocked = time.perf_counter() - t0
+        self._account(+1, blocked, item is not POISON)
+
+    def get(self, timeout: Optional[float] = None):
+        try:
+            item = self.q.get(timeout=timeout)
+        except queue.Empty:
+            return EMPTY
+        self._account(-1)
+        return item
+
+    def mean_occupancy(self) -> float:
+        self._account(0)
+        span = self.m[self.T_LAST] - self.m[self.T_START]
+        return self.m[self.AREA] / span if span > 0 else 0.0
+
+    @property
+    def max_len(self) -> int:
+        return min(int(self.m[self.MAX]), self.capacity)
+
+    @property
+    def puts(self) -> int:
+        return int(self.m[self.PUTS])
+
+    @property
+    def put_blocked_s(self) -> float:
+        return self.m[self.BLOCKED]
+
+    def __len__(self):
+        return int(self.m[self.LEN])
+
 # Sentinela (poison pill) para encerramento limpo
-POISON = object()
+POISON = _sentinel("POISON")
 
 # ==========================
-# Threads de estágios
+# Slab de quadros em memória compartilhada
 # ==========================
-def captura(N, out_q: BoundedQueue, ids_capturados: set, delay_ms_min, delay_ms_max):
-    rnd = random.Random(12345)
-    for i in range(N):
-        # simula tempo de captura
-        time.sleep(rnd.uniform(delay_ms_min, delay_ms_max) / 1000.0)
-        out_q.put(("frame", i))   # item = (tipo, id)
-        ids_capturados.add(i)
-    # poison pill para encerrar a cadeia
-    out_q.put(POISON)
+class FrameSlab:
+    """
+    `slots` quadros de `frame_bytes` num único SharedMemory. A fila leva só o
+    descritor (estágio, id, rastro, slot); o quadro nunca é serializado nem copiado.
+    Slots livres circulam numa mp.Queue: a fonte pega um (bloqueia se o slab
+    esgotou — mais um ponto de backpressure) e o último estágio devolve.
+    Cabeçalho e rodapé do quadro guardam o id: cada estágio confere que o slot
+    do descritor é mesmo daquele item (reuso prematuro ou troca de slot apareceriam aqui).
+    Com fork os processos herdam o mapeamento; com spawn/forkserver o SharedMemory
+    vai por pickle e o filho reabre o mesmo bloco pelo nome. Só o pai fecha/desvincula.
+    """
+    HDR = struct.Struct("<q")
 
-def processamento(in_q: BoundedQueue, out_q: BoundedQueue, ids_processados: set,
-                  delay_ms_min, delay_ms_max):
-    rnd = random.Random(67890)
-    while True:
-        item = in_q.get()
-        if item is POISON:
-            # encerrar e repassar poison pill adiante
-            out_q.put(POISON)
-            break
-        kind, i = item
-        # simula trabalho de CPU/IO do estágio
-        time.sleep(rnd.uniform(delay_ms_min, delay_ms_max) / 1000.0)
-        # "processa": aqui só marcamos o ID
-        ids_processados.add(i)
-        out_q.put(("proc", i))
-
-def gravacao(in_q: BoundedQueue, ids_gravados: set, delay_ms_min, delay_ms_max):
-    rnd = random.Random(54321)
-    while True:
-        item = in_q.get()
-        if item is POISON:
-            break
-        kind, i = item
-        # simula IO de gravação
-        time.sleep(rnd.uniform(delay_ms_min, delay_ms_max) / 1000.0)
-        ids_gravados.add(i)
+    def __init__(self, slots: int, frame_bytes: int):
+        self.slots = max(1, slots)
+        self.frame_bytes = max(2 * self.HDR.size, frame_bytes)
+        self.shm = shared_memory.SharedMemory(create=True, size=self.slots * self.frame_bytes)
+        self.free = mp.Queue()
+        for k in range(self.slots):
+            self.free.put(k)
+        self.in_use = mp.Value("i", 0)
+
+    def acquire(self, em=None) -> int:
+        try:
+            slot = self.free.get_nowait()
+        except queue.Empty:
+            # antes de bloquear, publica o lote parcial: seus slots precisam seguir adiante
+            if em is not None:
+                em.flush()
+            slot = self.free.get()
+        with self.in_use.get_lock():
+            self.in_use.value += 1
+        return slot
+
+    def release(self, slot: int):
+        with self.in_use.get_lock():
+            self.in_use.value -= 1
+        self.free.put(slot)
+
+    def write(self, slot: int, i: int):
+        off = slot * self.frame_bytes
+        self.HDR.pack_into(self.shm.buf, off, i)
+        self.HDR.pack_into(self.shm.buf, off + self.frame_bytes - self.HDR.size, i)
+
+    def check(self, slot: int, i: int) -> bool:
+        off = slot * self.frame_bytes
+        head = self.HDR.unpack_from(self.shm.buf, off)[0]
+        tail = self.HDR.unpack_from(self.shm.buf, off + self.frame_bytes - self.HDR.size)[0]
+        return head == i and tail == i
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+def cpu_work(iters: int) -> int:
+    """Trabalho de CPU sintético (segura o GIL): `iters` voltas de um laço Python."""
+    x = 0
+    for k in range(iters):
+        x += k
+    return x
 
 # ==========================
-# Driver + Asserções
+# Rastro por item
 # ==========================
-def main():
-    ap = argparse.ArgumentParser(description="Pipeline 3 estágios (captura -> processamento -> gravação) com threads")
-    ap.add_argument("-n", "--num", type=int, default=1000, help="N itens a processar")
-    ap.add_argument("-c1", "--cap1", type=int, default=8, help="Capacidade da fila entre captura e processamento")
-    ap.add_argument("-c2", "--cap2", type=int, default=8, help="Capacidade da fila entre processamento e gravação")
-    ap.add_argument("--cap-ms", type=str, default="1,4", help="Range ms captura: ex 1,4")
-    ap.add_argument("--proc-ms", type=str, default="2,5", help="Range ms processamento: ex 2,5")
-    ap.add_argument("--grav-ms", type=str, default="1,3", help="Range ms gravação: ex 1,3")
-    args = ap.parse_args()
+# Cada item carrega uma lista de carimbos, 5 por estágio percorrido:
+#   [desenfileirado, início do serviço, fim do serviço, enfileirado na saída, worker]
+# Na fonte desenfileirado = início; no último estágio enfileirado = fim.
+TRACE_SLOTS = 5
 
-    N = max(1, args.num)
-    cap1 = max(1, args.cap1)
-    cap2 = max(1, args.cap2)
+def stamp_enq(entry, now: float):
+    """Carimba 'enfileirado' em um item ou lote. Chamado ANTES do put: depois dele o item já é do consumidor."""
+    for _, _, tr, _ in (entry if type(entry) is list else (entry,)):
+        tr[-2] = now
 
-    cmin, cmax = [int(x) for x in args.cap_ms.split(",")]
-    pmin, pmax = [int(x) for x in args.proc_ms.split(",")]
-    gmin, gmax = [int(x) for x in args.grav_ms.split(",")]
+# ==========================
+# Reorder buffer: estágio paralelo que preserva a ordem
+# ==========================
+class ReorderBuffer:
+    """
+    Numera os itens na ordem em que ENTRAM no estágio (get serializado) e só os
+    libera para a fila de saída em sequência. A janela limita quantos itens podem
+    estar em voo (processando + esperando o antecessor): um worker que pegaria o
+    item seq >= next_seq + window bloqueia antes do get (backpressure).
+    Sem deadlock: o item next_seq já foi retirado por algum worker e nunca espera
+    pela janela. Métricas: ocupação média/pico do buffer (itens prontos parados)
+    e bloqueio head-of-line (tempo entre ficar pronto e ser liberado).
+    """
+    def __init__(self, window: int, out_q: Optional[BoundedQueue]):
+        self.window = max(1, window)
+        self.out_q = out_q
+        self.slots = th.Semaphore(self.window)
+        self.in_lock = th.Lock()    # get + numeração atômicos
+        self.lock = th.Lock()       # pending/next_seq/métricas
+        self.emit_lock = th.Lock()  # um liberador por vez mantém a ordem na fila de saída
+        self.pending = {}           # seq -> (item, t_pronto)
+        self.seq = 0
+        self.next_seq = 0
+        self.t_start = self.t_last = time.perf_counter()
+        self.area = 0.0
+        self.max_len = 0
+        self.window_blocked_s = 0.0
+        self.hol_s = 0.0
+        self.hol_max_s = 0.0
+        self.hol_items = 0          # entradas (item ou lote) paradas atrás de um antecessor
+
+    def _touch(self, now: float):
+        self.area += len(self.pending) * (now - self.t_last)
+        self.t_last = now
+
+    def take(self, in_q: BoundedQueue):
+        """Reserva um lugar na janela e retira o próximo item: (seq, item) ou (None, POISON)."""
+        if not self.slots.acquire(blocking=False):
+            t0 = time.perf_counter()
+            self.slots.acquire()
+            with self.lock:
+                self.window_blocked_s += time.perf_counter() - t0
+        with self.in_lock:
+            item = in_q.get()
+            if item is POISON:
+                self.slots.release()
+                return None, POISON
+            seq = self.seq
+            self.seq += 1
+        return seq, item
+
+    def done(self, seq: int, item):
+        """Entrega o item pronto e libera, em ordem, tudo o que já é contíguo a next_seq."""
+        with self.lock:
+            now = time.perf_counter()
+            self._touch(now)
+            self.pending[seq] = (item, now)
+            if len(self.pending) > self.max_len:
+                self.max_len = len(self.pending)
+        with self.emit_lock:
+            while True:
+                with self.lock:
+                    entry = self.pending.pop(self.next_seq, None)
+                    if entry is None:
+                        break
+                    now = time.perf_counter()
+                    self._touch(now)
+                    self.next_seq += 1
+                    wait = now - entry[1]
+                    self.hol_s += wait
+                    if wait > self.hol_max_s:
+                        self.hol_max_s = wait
+                    if self.next_seq - 1 != seq:
+                        self.hol_items += 1
+                if self.out_q is not None:
+                    stamp_enq(entry[0], time.perf_counter())
+                    self.out_q.put(entry[0])
+                self.slots.release()
+
+    def mean_occupancy(self) -> float:
+        with self.lock:
+            self._touch(time.perf_counter())
+            span = self.t_last - self.t_start
+            return self.area / span if span > 0 else 0.0
+
+# ==========================
+# Estágios declarativos
+# ==========================
+class Stage:
+    """
+    Um estágio do pipeline: nome, nº de workers e faixa de atraso simulado (ms) por item.
+    O primeiro estágio da lista é a fonte (gera os IDs 0..N-1, repartidos entre
+    os workers); o último é o sorvedouro (não tem fila de saída).
+    Cada worker acumula em variáveis locais e funde no Stage ao sair (finish).
+    ordered=True: os workers passam por um ReorderBuffer e a saída mantém a ordem de entrada.
+    proc=True: cada worker é um processo; as estatísticas voltam ao pai por uma fila de resultados.
+    work: voltas de cpu_work por item (trabalho que segura o GIL), além do sleep.
+    """
+    def __init__(self, name: str, workers: int = 1, ms: Tuple[float, float] = (0, 0), seed: int = 0,
+                 ordered: bool = False, window: int = 16, proc: bool = False, work: int = 0):
+        self.name = name
+        self.workers = max(1, workers)
+        self.ms_min, self.ms_max = ms
+        self.seed = seed
+        self.ordered = ordered
+        self.window = window
+        self.reorder: Optional[ReorderBuffer] = None
+        self.proc = proc
+        self.work = max(0, work)
+        self.shared_done = None  # mp.Value: workers concluídos, quando o estágio roda em processos
+        self.lock = th.Lock()
+        self.ids = set()
+        self.count = 0           # itens tratados (soma dos workers): pega duplicação que o set esconderia
+        self.inversions = 0      # IDs recebidos fora de ordem (por worker)
+        self.traces: List[Tuple[int, list]] = []  # (id, rastro completo) de cada item, só no último estágio
+        self.busy_s = 0.0        # tempo de serviço somado dos workers (sem esperas nas filas)
+        self.bad_frames = 0      # quadros cujo slot não trazia o id do descritor
+        self.done_workers = 0
+
+    def __getstate__(self):
+        # estágio proc com "spawn"/"forkserver": o filho recebe o Stage por pickle, sem o lock de threads
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = th.Lock()
+
+    def stats(self) -> tuple:
+        return self.ids, self.count, self.busy_s, self.inversions, self.traces, self.bad_frames
+
+    def merge(self, ids: set, count: int, busy_s: float, inversions: int = 0,
+              traces: Optional[List[Tuple[int, list]]] = None, bad_frames: int = 0):
+        with self.lock:
+            self.ids |= ids
+            self.count += count
+            self.busy_s += busy_s
+            self.inversions += inversions
+            self.bad_frames += bad_frames
+            if traces:
+                self.traces.extend(traces)
 
-    q12 = BoundedQueue(cap1)
-    q23 = BoundedQueue(cap2)
+    def finish(self, ids: set, count: int, busy_s: float, out_q: Optional[BoundedQueue], next_workers: int,
+               inversions: int = 0, traces: Optional[List[Tuple[int, list]]] = None, bad_frames: int = 0):
+        """
+        Funde as estatísticas do worker. O ÚLTIMO worker do estágio a sair envia
+        um POISON por worker do estágio seguinte: cada um consome exatamente um.
+        Em processos a contagem de concluídos é o mp.Value compartilhado.
+        """
+        self.merge(ids, count, busy_s, inversions, traces, bad_frames)
+        if self.shared_done is not None:
+            with self.shared_done.get_lock():
+                self.shared_done.value += 1
+                last = self.shared_done.value == self.workers
+        else:
+            with self.lock:
+                self.done_workers += 1
+                last = self.done_workers == self.workers
+        if last and out_q is not None:
+            for _ in range(next_workers):
+                out_q.put(POISON)
 
-    # Conjuntos para validar integridade (sem perdas/duplicações)
-    ids_capturados = set()
-    ids_processados = set()
-    ids_gravados   = set()
+def parse_stages(spec: str, window: int = 16) -> List[Stage]:
+    """'captura:1:1-4,processamento:4:2-5:ordered,gravacao:1:1-3' → [Stage, ...]."""
+    stages = []
+    for k, part in enumerate(x.strip() for x in spec.split(",") if x.strip()):
+        fields = part.split(":")
+        name, workers, ms, opts = fields + ["", "1", "0-0", ""][len(fields):]
+        lo, _, hi = ms.partition("-")
+        lo = float(lo)
+        hi = float(hi) if hi else lo
+        opts = dict((o.strip().split("=", 1) + [""])[:2] for o in opts.split("+") if o.strip())
+        unknown = set(opts) - {"ordered", "proc", "work"}
+        if unknown:
+            raise SystemExit(f"opção de estágio desconhecida: {', '.join(sorted(unknown))}")
+        stages.append(Stage(name, int(workers), (lo, max(lo, hi)), seed=12345 + 11111 * k,
+                            ordered="ordered" in opts, window=window,
+                            proc="proc" in opts, work=int(opts.get("work") or 0)))
+    if len(stages) < 2:
+        raise SystemExit("--stages precisa de ao menos 2 estágios (fonte e gravação)")
+    validate_stages(stages)
+    return stages
 
-    t_cap = th.Thread(target=captura, args=(N, q12, ids_capturados, cmin, cmax))
-    t_proc = th.Thread(target=processamento, args=(q12, q23, ids_processados, pmin, pmax))
-    t_grav = th.Thread(target=gravacao, args=(q23, ids_gravados, gmin, gmax))
+def validate_stages(stages: List[Stage]):
+    if stages[0].ordered:
+        raise SystemExit("a fonte já emite em ordem por worker; 'ordered' vale para os estágios seguintes")
+    for st in stages:
+        if st.ordered and st.proc:
+            raise SystemExit(f"{st.name}: 'ordered' usa um reorder buffer entre threads; não combina com 'proc'")
+
+def order_preserved(stages: List[Stage], k: int) -> bool:
+    """A entrada do estágio k chega em ordem se tudo antes dele tem 1 worker ou é ordered."""
+    return all(st.workers == 1 or (st.ordered and j > 0) for j, st in enumerate(stages[:k]))
+
+# ==========================
+# Micro-lotes
+# ==========================
+class Emitter:
+    """
+    Saída de um worker: com batch > 1 acumula itens e publica a lista inteira num
+    único put (um lock/notify/wakeup por lote). Um lote parcial sai quando completa
+    linger_s desde o primeiro item (due() == 0) ou no flush final, antes do poison.
+    """
+    def __init__(self, out_q: Optional[BoundedQueue], batch: int = 1, linger_s: float = 0.0):
+        self.out_q = out_q
+        self.batch = max(1, batch)
+        self.linger_s = linger_s
+        self.buf: list = []
+        self.t_first = 0.0
+
+    def emit(self, x):
+        if self.out_q is None:
+            return
+        if self.batch == 1:
+            stamp_enq(x, time.perf_counter())
+            self.out_q.put(x)
+            return
+        if not self.buf:
+            self.t_first = time.perf_counter()
+        self.buf.append(x)
+        if len(self.buf) >= self.batch:
+            self.flush()
+
+    def due(self) -> Optional[float]:
+        """Segundos até o lote parcial vencer (None se não há lote aberto)."""
+        if not self.buf:
+            return None
+        return max(0.0, self.t_first + self.linger_s - time.perf_counter())
+
+    def flush(self):
+        if self.buf:
+            stamp_enq(self.buf, time.perf_counter())
+            self.out_q.put(self.buf)
+            self.buf = []
+
+# ==========================
+# Workers
+# ==========================
+# com micro-lotes a fila transporta listas de itens
+# item = (estágio, id, rastro, slot); slot = -1 sem slab de quadros
+def source_worker(st: Stage, wid: int, N: int, out_q: BoundedQueue, next_workers: int,
+                  batch: int = 1, linger_s: float = 0.0, slab: Optional[FrameSlab] = None):
+    rnd = random.Random(st.seed + wid)
+    em = Emitter(out_q, batch, linger_s)
+    ids, count, busy = set(), 0, 0.0
+    for i in range(wid, N, st.workers):
+        slot = slab.acquire(em) if slab is not None else -1
+        t0 = time.perf_counter()
+        # simula tempo de captura (faixa 0,0: sem sleep, só o custo do pipeline)
+        d = rnd.uniform(st.ms_min, st.ms_max)
+        if d > 0:
+            time.sleep(d / 1000.0)
+        if slab is not None:
+            slab.write(slot, i)
+        if st.work:
+            cpu_work(st.work)
+        t_cap = time.perf_counter()
+        busy += t_cap - t0
+        em.emit((st.name, i, [t0, t0, t_cap, t_cap, wid], slot))
+        # a fonte nunca bloqueia na entrada: o linger é conferido a cada captura
+        if em.due() == 0:
+            em.flush()
+        ids.add(i)
+        count += 1
+    em.flush()
+    st.finish(ids, count, busy, out_q, next_workers)
+
+def stage_worker(st: Stage, wid: int, in_q: BoundedQueue, out_q: Optional[BoundedQueue], next_workers: int,
+                 batch: int = 1, linger_s: float = 0.0, slab: Optional[FrameSlab] = None):
+    rnd = random.Random(st.seed + wid)
+    em = Emitter(out_q, batch, linger_s)
+    ids, count, busy, bad = set(), 0, 0.0, 0
+    inversions, last = 0, -1
+    traces = [] if out_q is None else None
+    rb = st.reorder
+    while True:
+        if rb is not None:
+            # ordered: o lote de entrada é a unidade de reordenação e sai inteiro
+            seq, item = rb.take(in_q)
+        else:
+            # com lote aberto, espera só até o linger vencer; aí publica o parcial
+            item = in_q.get(em.due())
+            if item is EMPTY:
+                em.flush()
+                continue
+        t_deq = time.perf_counter()
+        if item is POISON:
+            # este worker terminou; o último do estágio repassa o poison adiante
+            break
+        batched = type(item) is list
+        out = []
+        for kind, i, tr, slot in (item if batched else (item,)):
+            if i < last:
+                inversions += 1
+            last = i
+            t0 = time.perf_counter()
+            # simula trabalho de CPU/IO do estágio
+            d = rnd.uniform(st.ms_min, st.ms_max)
+            if d > 0:
+                time.sleep(d / 1000.0)
+            if slot >= 0 and not slab.check(slot, i):
+                bad += 1
+            if st.work:
+                cpu_work(st.work)
+            t1 = time.perf_counter()
+            busy += t1 - t0
+            ids.add(i)
+            count += 1
+            tr += (t_deq, t0, t1, t1, wid)   # 'enfileirado' é recarimbado na publicação
+            if traces is not None:
+                traces.append((i, tr))
+                if slot >= 0:
+                    slab.release(slot)   # quadro gravado: slot volta ao slab
+                    slot = -1
+            out.append((st.name, i, tr, slot))
+        if rb is not None:
+            rb.done(seq, out if batched else out[0])   # o reorder buffer publica em out_q na ordem de entrada
+        else:
+            for x in out:
+                em.emit(x)
+    em.flush()
+    st.finish(ids, count, busy, out_q, next_workers, inversions, traces, bad)
+
+def process_worker(target, st: Stage, k: int, results, *args):
+    """Corpo de um worker em processo: roda o laço de sempre e devolve as estatísticas ao pai."""
+    target(st, *args)
+    results.put((k, st.stats()))
+
+def run_pipeline(N: int, stages: List[Stage], caps: List[int], batch: int = 1, linger_s: float = 0.0,
+                 slab: Optional[FrameSlab] = None) -> Tuple[float, List[BoundedQueue]]:
+    """
+    Monta filas e threads (ou processos, nos estágios proc) a partir da lista de
+    estágios, roda até o fim e devolve (elapsed, filas). Fila que toca um estágio
+    proc vira ProcQueue; as demais continuam BoundedQueue.
+    """
+    queues = [ProcQueue(max(1, c)) if stages[k].proc or stages[k + 1].proc else BoundedQueue(max(1, c))
+              for k, c in enumerate(caps)]
+    results = mp.Queue() if any(st.proc for st in stages) else None
+    workers = []
+    for k, st in enumerate(stages):
+        out_q = queues[k] if k < len(queues) else None
+        next_workers = stages[k + 1].workers if k + 1 < len(stages) else 0
+        if st.ordered and k > 0:
+            st.reorder = ReorderBuffer(st.window, out_q)
+        if st.proc:
+            st.shared_done = mp.Value("i", 0)
+        for w in range(st.workers):
+            if k == 0:
+                target, args = source_worker, (st, w, N, out_q, next_workers, batch, linger_s, slab)
+            else:
+                target, args = stage_worker, (st, w, queues[k - 1], out_q, next_workers, batch, linger_s, slab)
+            if st.proc:
+                workers.append(mp.Process(target=process_worker, args=(target, st, k, results) + args[1:],
+                                          name=f"{st.name}-{w}"))
+            else:
+                workers.append(th.Thread(target=target, args=args, name=f"{st.name}-{w}"))
 
     t0 = time.perf_counter()
-    t_cap.start(); t_proc.start(); t_grav.start()
+    for q in queues + [st.reorder for st in stages if st.reorder is not None]:
+        q.t_start = q.t_last = t0
+    # processos primeiro: com fork, a cópia acontece antes de qualquer thread do pipeline estar rodando
+    workers.sort(key=lambda t: not isinstance(t, mp.Process))
+    for t in workers:
+        t.start()
+    # resultados dos processos antes do join (a fila de resultados precisa ser esvaziada)
+    pending = sum(st.workers for st in stages if st.proc)
+    while pending:
+        try:
+            k, stats = results.get(timeout=1.0)
+        except queue.Empty:
+            dead = [p.name for p in workers if isinstance(p, mp.Process) and p.exitcode not in (None, 0)]
+            assert not dead, f"Processo(s) worker falharam: {dead}"
+            continue
+        stages[k].merge(*stats)
+        pending -= 1
     # Aguarda todas as etapas (se houvesse deadlock, travaria aqui — o que não ocorre)
-    t_cap.join(); t_proc.join(); t_grav.join()
+    for t in workers:
+        t.join()
     elapsed = time.perf_counter() - t0
+    failed = [p.exitcode for p in workers if isinstance(p, mp.Process) and p.exitcode != 0]
+    assert not failed, f"Processo(s) worker falharam: exitcodes={failed}"
+    return elapsed, queues
 
-    # ==========================
-    # Provas via asserções
-    # ==========================
+def check_pipeline(N: int, stages: List[Stage], queues: List[BoundedQueue], slab: Optional[FrameSlab] = None):
+    """Provas via asserções, item a item (também com micro-lotes)."""
     # 1) Todas as threads terminaram => não houve deadlock
-    # (se chegamos aqui, join retornou nas 3)
+    # (se chegamos aqui, join retornou em todas)
 
-    # 2) Integridade dos dados: IDs preservados sem perdas ou duplicações
+    # 2) Integridade dos dados: IDs preservados sem perdas ou duplicações, em cada estágio
     expected = set(range(N))
-    assert ids_capturados == expected, f"Captura incorreta: {len(ids_capturados)} != {N}"
-    assert ids_processados == expected, f"Processamento incorreto: {len(ids_processados)} != {N}"
-    assert ids_gravados   == expected, f"Gravação incorreta: {len(ids_gravados)} != {N}"
+    for st in stages:
+        assert st.ids == expected, f"{st.name} incorreto: {len(st.ids)} != {N}"
+        assert st.count == N, f"{st.name} tratou {st.count} itens (duplicação ou perda)"
+
+    # 3) Cardinalidade igual em todos os estágios e filas vazias no fim
+    assert len({len(st.ids) for st in stages}) == 1, "Tamanhos divergentes"
+    assert all(len(q) == 0 for q in queues), "Sobrou item (ou poison) em alguma fila"
+    # cada item chegou ao fim com exatamente um trecho de rastro por estágio
+    assert len(stages[-1].traces) == N, "Rastro não registrado para todos os itens"
+    assert all(len(tr) == TRACE_SLOTS * len(stages) for _, tr in stages[-1].traces), "Rastro com estágios faltando"
+
+    # 4) Quadros no slab: cada estágio leu o id certo no slot do descritor e todos os slots voltaram
+    for st in stages:
+        assert st.bad_frames == 0, f"{st.name} leu {st.bad_frames} quadros com id errado no slab"
+    if slab is not None:
+        assert slab.in_use.value == 0, f"{slab.in_use.value} slots do slab não foram devolvidos"
+
+    # 5) Ordem: um estágio com 1 worker cuja entrada só passou por estágios sequenciais
+    #    ou ordered recebe os IDs em sequência
+    for k, st in enumerate(stages):
+        if k > 0 and st.workers == 1 and order_preserved(stages, k):
+            assert st.inversions == 0, f"{st.name} recebeu {st.inversions} itens fora de ordem"
+        if st.reorder is not None:
+            rb = st.reorder
+            assert not rb.pending and rb.next_seq == rb.seq, f"reorder buffer de {st.name} não esvaziou"
+
+def percentile(sorted_xs: List[float], p: float) -> float:
+    if not sorted_xs:
+        return 0.0
+    k = min(len(sorted_xs) - 1, max(0, int(round(p / 100.0 * (len(sorted_xs) - 1)))))
+    return sorted_xs[k]
+
+def e2e_ms(stages: List[Stage]) -> Tuple[float, float]:
+    """Latência fim a fim: fim da captura -> fim do último estágio."""
+    end = TRACE_SLOTS * (len(stages) - 1) + 2
+    lat = sorted(tr[end] - tr[2] for _, tr in stages[-1].traces)
+    return 1000 * percentile(lat, 50), 1000 * percentile(lat, 99)
 
-    # 3) Cardinalidade igual em todos os estágios
-    assert len(ids_capturados) == len(ids_processados) == len(ids_gravados) == N, "Tamanhos divergentes"
+def stage_breakdown(stages: List[Stage]) -> List[dict]:
+    """
+    Por estágio, listas ordenadas (s) de:
+      fila    = desenfileirado - enfileirado pelo estágio anterior (inclui put bloqueado)
+      lote    = início do serviço - desenfileirado (itens anteriores do mesmo lote)
+      servico = fim - início
+      saida   = enfileirado - fim (linger do lote, espera de reordenação)
+    """
+    out = [{"fila": [], "lote": [], "servico": [], "saida": []} for _ in stages]
+    for _, tr in stages[-1].traces:
+        for k, d in enumerate(out):
+            b = TRACE_SLOTS * k
+            deq, start, end, enq = tr[b:b + 4]
+            if k > 0:
+                d["fila"].append(deq - tr[b - 2])
+                d["lote"].append(start - deq)
+            d["servico"].append(end - start)
+            d["saida"].append(enq - end)
+    for d in out:
+        for xs in d.values():
+            xs.sort()
+    return out
 
-    # ==========================
-    # Relatório
-    # ==========================
+def write_chrome_trace(path: str, stages: List[Stage]):
+    """
+    Trace-event JSON (chrome://tracing, Perfetto): serviço como evento 'X' na linha
+    do worker; espera na fila como evento assíncrono b/e agrupado por item.
+    """
+    t_base = min(tr[0] for _, tr in stages[-1].traces)
+    us = lambda t: round((t - t_base) * 1e6, 3)
+    tids = {}
+    events = []
+    for k, st in enumerate(stages):
+        for w in range(st.workers):
+            tids[(k, w)] = len(tids) + 1
+            events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tids[(k, w)],
+                           "args": {"name": f"{st.name}-{w}"}})
+    for i, tr in stages[-1].traces:
+        for k, st in enumerate(stages):
+            b = TRACE_SLOTS * k
+            deq, start, end, enq, wid = tr[b:b + 5]
+            tid = tids[(k, int(wid))]
+            events.append({"name": st.name, "cat": "servico", "ph": "X", "pid": 1, "tid": tid,
+                           "ts": us(start), "dur": us(end) - us(start), "args": {"id": i}})
+            if k > 0:
+                wait = {"name": f"fila -> {st.name}", "cat": "fila", "pid": 1, "tid": tid}
+                events.append(dict(wait, ph="b", id=i, ts=us(tr[b - 2])))
+                events.append(dict(wait, ph="e", id=i, ts=us(deq)))
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+def print_report(N: int, stages: List[Stage], queues: List[BoundedQueue], elapsed: float,
+                 batch: int = 1, linger_s: float = 0.0, slab: Optional[FrameSlab] = None):
     thr = N / elapsed if elapsed > 0 else 0.0
+    p50, p99 = e2e_ms(stages)
     print("\n=== PIPELINE OK ===")
-    print(f"Itens: {N} | Fila1 cap: {cap1} | Fila2 cap: {cap2}")
+    print(f"Itens: {N} | Estágios: {' -> '.join(f'{s.name}(x{s.workers})' for s in stages)}")
+    if batch > 1:
+        print(f"Micro-lotes: até {batch} itens por put | linger={1000 * linger_s:.1f}ms")
+    if slab is not None:
+        print(f"Quadros: slab de memória compartilhada, {slab.slots} x {slab.frame_bytes // 1024} KB "
+              f"(na fila só o descritor)")
     print(f"Tempo: {elapsed:.3f}s | Throughput: {thr:.1f} itens/s")
-    print("Sem deadlock (todas as threads encerraram).")
+    print(f"Latência fim a fim (captura -> {stages[-1].name}): p50={p50:.2f}ms p99={p99:.2f}ms")
+    print("\nms (p50/p99)         espera na fila   espera no lote        serviço  saída (linger/ordem)")
+    for st, d in zip(stages, stage_breakdown(stages)):
+        cols = [f"{1000 * percentile(d[key], 50):.2f}/{1000 * percentile(d[key], 99):.2f}" if d[key] else "-"
+                for key in ("fila", "lote", "servico", "saida")]
+        print(f"{st.name:20} {cols[0]:>14}   {cols[1]:>14} {cols[2]:>14}  {cols[3]:>20}")
+    print("\nestágio              workers  itens/s  capacidade/s  utilização  fora de ordem")
+    for st in stages:
+        # capacidade: o que o estágio sustentaria se nunca esperasse nas filas
+        cap_rate = st.count * st.workers / st.busy_s if st.busy_s > 0 else float("inf")
+        util = st.busy_s / (st.workers * elapsed) if elapsed > 0 else 0.0
+        name = st.name + (" [ord]" if st.reorder is not None else "") + (" [proc]" if st.proc else "")
+        print(f"{name:20} {st.workers:7}  {st.count / elapsed:7.1f}  {cap_rate:12.1f}  {100 * util:9.1f}%"
+              f"  {st.inversions:13}")
+    print("\nfila                         cap  ocupação média  pico  put bloqueado (s)   puts  itens/put")
+    for k, q in enumerate(queues):
+        label = f"{stages[k].name} -> {stages[k + 1].name}"
+        per_put = N / q.puts if q.puts else 0.0
+        print(f"{label:28} {q.capacity:3}  {q.mean_occupancy():14.2f}  {q.max_len:4}  {q.put_blocked_s:17.3f}"
+              f"  {q.puts:5}  {per_put:9.1f}")
+    for st in stages:
+        rb = st.reorder
+        if rb is None:
+            continue
+        hol_mean = 1000 * rb.hol_s / rb.seq if rb.seq else 0.0
+        print(f"\nReorder buffer [{st.name}] janela={rb.window}: ocupação média={rb.mean_occupancy():.2f} "
+              f"pico={rb.max_len} | janela cheia (s)={rb.window_blocked_s:.3f}")
+        print(f"  head-of-line: {rb.hol_items} de {rb.seq} entradas esperaram antecessor | total={rb.hol_s:.3f}s "
+              f"médio={hol_mean:.2f}ms máx={1000 * rb.hol_max_s:.2f}ms")
+    print("\nSem deadlock (todas as threads encerraram).")
     print("Sem perda/duplicação (IDs batem em todos os estágios).")
 
+def build_stages(args) -> List[Stage]:
+    """Estágios novos a cada execução (as estatísticas ficam nos objetos Stage)."""
+    if args.stages.strip():
+        stages = parse_stages(args.stages, args.reorder_window)
+    else:
+        cmin, cmax = [float(x) for x in args.cap_ms.split(",")]
+        pmin, pmax = [float(x) for x in args.proc_ms.split(",")]
+        gmin, gmax = [float(x) for x in args.grav_ms.split(",")]
+        w = ([int(x) for x in args.workers.split(",") if x.strip()] + [1, 1, 1])[:3]
+        stages = [Stage("captura", w[0], (cmin, cmax), seed=12345),
+                  Stage("processamento", w[1], (pmin, pmax), seed=67890,
+                        ordered=args.ordered, window=args.reorder_window, work=args.work),
+                  Stage("gravacao", w[2], (gmin, gmax), seed=54321)]
+    names = {x.strip() for x in args.proc_stages.split(",") if x.strip()}
+    unknown = names - {st.name for st in stages}
+    if unknown:
+        raise SystemExit(f"--proc-stages: estágio inexistente: {', '.join(sorted(unknown))}")
+    for st in stages:
+        st.proc = st.proc or st.name in names
+    validate_stages(stages)
+    return stages
+
+# ==========================
+# Driver + Asserções
+# ==========================
+def main():
+    ap = argparse.ArgumentParser(description="Pipeline de N estágios (captura -> processamento -> gravação) com threads")
+    ap.add_argument("-n", "--num", type=int, default=1000, help="N itens a processar")
+    ap.add_argument("-c1", "--cap1", type=int, default=8, help="Capacidade da fila entre captura e processamento")
+    ap.add_argument("-c2", "--cap2", type=int, default=8, help="Capacidade da fila entre processamento e gravação")
+    ap.add_argument("--cap-ms", type=str, default="1,4", help="Range ms captura: ex 1,4")
+    ap.add_argument("--proc-ms", type=str, default="2,5", help="Range ms processamento: ex 2,5")
+    ap.add_argument("--grav-ms", type=str, default="1,3", help="Range ms gravação: ex 1,3")
+    ap.add_argument("-w", "--workers", type=str, default="1,1,1",
+                    help="Workers por estágio do pipeline padrão (captura,processamento,gravação): ex 1,4,1")
+    ap.add_argument("--stages", type=str, default="",
+                    help="Pipeline arbitrário: nome:workers:ms_min-ms_max separados por vírgula "
+                         "(o 1º é a fonte, o último grava). Substitui -w/--cap-ms/--proc-ms/--grav-ms")
+    ap.add_argument("--caps", type=str, default="",
+                    help="Capacidades das filas entre estágios (uma a menos que os estágios; padrão: -c1/-c2, depois 8)")
+    ap.add_argument("--ordered", action="store_true",
+                    help="Pipeline padrão: processamento paralelo preserva a ordem (reorder buffer)")
+    ap.add_argument("--reorder-window", type=int, default=16,
+                    help="Máx. de entradas em voo num estágio ordered (processando + esperando o antecessor)")
+    ap.add_argument("--batch", type=str, default="1",
+                    help="Itens por put entre estágios (micro-lote); lista para varrer: ex 1,8,32")
+    ap.add_argument("--linger-ms", type=str, default="1",
+                    help="Espera máx. (ms) de um lote parcial antes de ser publicado; lista para varrer: ex 0,2,5")
+    ap.add_argument("--trace-out", type=str, default="",
+                    help="Exporta o rastro por item em trace-event JSON (chrome://tracing / Perfetto); "
+                         "numa varredura, grava a última execução")
+    ap.add_argument("--work", type=int, default=0,
+                    help="Pipeline padrão: voltas de trabalho de CPU (segura o GIL) por item no processamento")
+    ap.add_argument("--proc-stages", type=str, default="",
+                    help="Estágios que rodam em processos (um por worker), separados por vírgula: ex processamento")
+    ap.add_argument("--frame-kb", type=int, default=0,
+                    help="Tamanho do quadro (KB) num slab de memória compartilhada; a fila leva só o descritor "
+                         "(0 = sem payload)")
+    ap.add_argument("--slab-slots", type=int, default=0,
+                    help="Quadros no slab (0 = automático: capacidades + workers + janelas, vezes o lote)")
+    ap.add_argument("--start-method", choices=mp.get_all_start_methods(), default=None,
+                    help="Como criar os processos dos estágios proc (padrão: o da plataforma)")
+    args = ap.parse_args()
+    if args.start_method:
+        mp.set_start_method(args.start_method)
+
+    N = max(1, args.num)
+    batches = [max(1, int(x)) for x in args.batch.split(",") if x.strip()] or [1]
+    lingers = [max(0.0, float(x)) for x in args.linger_ms.split(",") if x.strip()] or [0.0]
+    # linger não se aplica sem lote: batch=1 roda uma vez só
+    grid = [(b, l) for b in batches for l in (lingers if b > 1 else lingers[:1])]
+
+    rows = []
+    for batch, linger_ms in grid:
+        stages = build_stages(args)
+        caps = [int(x) for x in args.caps.split(",") if x.strip()]
+        caps = (caps + [args.cap1, args.cap2][len(caps):] + [8] * len(stages))[:len(stages) - 1]
+        caps = [max(1, c) for c in caps]
+
+        slab = None
+        if args.frame_kb > 0:
+            slots = args.slab_slots or (sum(caps) + sum(st.workers for st in stages)
+                                        + sum(st.window for st in stages if st.ordered)) * batch
+            slab = FrameSlab(slots, args.frame_kb * 1024)
+        try:
+            elapsed, queues = run_pipeline(N, stages, caps, batch, linger_ms / 1000.0, slab)
+            check_pipeline(N, stages, queues, slab)
+        finally:
+            if slab is not None:
+                slab.close()
+
+        if args.trace_out:
+            write_chrome_trace(args.trace_out, stages)
+
+        if len(grid) == 1:
+            print_report(N, stages, queues, elapsed, batch, linger_ms / 1000.0, slab)
+        else:
+            p50, p99 = e2e_ms(stages)
+            rows.append((batch, linger_ms, N / elapsed, p50, p99, sum(q.puts for q in queues)))
+            print(f"batch={batch:<4} linger={linger_ms:g}ms  {N / elapsed:9.1f} itens/s  "
+                  f"p50={p50:.2f}ms p99={p99:.2f}ms  (asserções OK)")
+
+    if args.trace_out:
+        print(f"\nRastro salvo em {args.trace_out} (abra em chrome://tracing ou ui.perfetto.dev)")
+    if rows:
+        # vazão x latência: lotes maiores diluem a sincronização, linger maior segura itens na fila
+        print("\n=== MICRO-LOTES: vazão x latência fim a fim ===")
+        print("batch  linger(ms)    itens/s   p50(ms)   p99(ms)    puts")
+        for batch, linger_ms, thr, p50, p99, puts in rows:
+            print(f"{batch:5}  {linger_ms:10g}  {thr:9.1f}  {p50:8.2f}  {p99:8.2f}  {puts:6}")
+        print("\nSem deadlock e sem perda/duplicação em todas as execuções.")
+
 if __name__ == "__main__":
     main()
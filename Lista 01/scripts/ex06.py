@@ -5,10 +5,37 @@
     # Sweep com speedup (1,2,4,8) + verificação de corretude
         # python ex06.py data.txt --sweep
 
+    # Backend de processos (map fora do GIL; cada processo abre seu próprio mmap)
+        # python ex06.py data.txt -p 4 --backend process
+        # python ex06.py data.txt --sweep --backend process
+
+    # Engine vetorizada (NumPy) e comparação/validação cruzada entre engines
+        # python ex06.py data.txt -p 4 --engine numpy
+        # python ex06.py data.txt --sweep --engine all
+
+    # Histograma esparso (Counter) em vez do denso (array, padrão)
+        # python ex06.py data.txt --sweep --hist sparse
+
+    # Streaming em blocos (stdin/pipe, .gz/.bz2/.xz, arquivos maiores que o mmap confortável)
+        # python ex06.py data.txt -p 4 --stream --block-kb 1024
+        # gzip -c data.txt | python ex06.py - --stream
+
+    # Cache persistente de parciais (arquivos append-only: só o final novo é parseado)
+        # python ex06.py data.txt -p 4 --cache
+
+    # Sobre-decomposição: muitos chunks alinhados em '\n' puxados por P workers (balanceamento dinâmico)
+        # python ex06.py data.txt --sweep --chunk-kb 256
+
 # -*- coding: utf-8 -*-
-import argparse, mmap, os, threading as th, time
+import argparse, bz2, gzip, hashlib, json, lzma, mmap, os, queue, sys, threading as th, time
 from collections import Counter
-from typing import List, Tuple, Dict, Any
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Tuple, Dict, Any, Optional, Union
+
+try:
+    import numpy as np  # opcional: só exigido por --engine numpy
+except ImportError:
+    np = None
 
 # -------------------------
 # Util
@@ -16,17 +43,110 @@ from typing import List, Tuple, Dict, Any
 def human_time(s: float) -> str:
     return f"{s:.3f}s" if s >= 0.010 else f"{s*1e3:.2f}ms"
 
+# -------------------------
+# Histograma denso (array indexado por valor - lo) com fallback esparso
+# -------------------------
+HIST_MODES = ("dense", "sparse")
+HIST_MAX_RANGE = 1 << 20  # faixa máxima (hi - lo) mantida em array; acima disso → Counter
+
+class DenseHist:
+    """
+    Histograma de inteiros em [lo, lo+len(counts)) guardado como vetor de contagens.
+    Memória/merge proporcionais à faixa de valores, não ao número de chaves distintas.
+    counts é list (engine python) ou np.ndarray (engine numpy); o merge usa soma vetorial.
+    """
+    __slots__ = ("lo", "counts")
+
+    def __init__(self, lo: int, counts):
+        self.lo = lo
+        self.counts = counts
+
+    @property
+    def hi(self) -> int:
+        return self.lo + len(self.counts)
+
+    def total(self) -> int:
+        return int(sum(self.counts)) if np is None else int(np.sum(self.counts, dtype=np.int64))
+
+    def items(self):
+        lo = self.lo
+        if np is not None and isinstance(self.counts, np.ndarray):
+            keys = np.flatnonzero(self.counts)
+            # lo somado em int do Python: valores fora de int64 (lo > 2**63) não estouram
+            yield from zip((k + lo for k in keys.tolist()), self.counts[keys].tolist())
+            return
+        for k, c in enumerate(self.counts):
+            if c:
+                yield lo + k, int(c)
+
+    def to_counter(self) -> Counter:
+        return Counter(dict(self.items()))
+
+    def most_common(self, k: int) -> List[Tuple[int, int]]:
+        return self.to_counter().most_common(k)
+
+    def __bool__(self) -> bool:
+        return any(self.counts)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, DenseHist):
+            return dict(self.items()) == dict(other.items())
+        if isinstance(other, dict):
+            return dict(self.items()) == {k: v for k, v in other.items() if v}
+        return NotImplemented
+
+    def merge(self, other: "DenseHist") -> Union["DenseHist", Counter]:
+        lo, hi = min(self.lo, other.lo), max(self.hi, other.hi)
+        if hi - lo > HIST_MAX_RANGE:
+            return hist_merge(self.to_counter(), other)
+        if np is not None:
+            out = np.zeros(hi - lo, dtype=np.int64)
+            out[self.lo - lo:self.hi - lo] += np.asarray(self.counts, dtype=np.int64)
+            out[other.lo - lo:other.hi - lo] += np.asarray(other.counts, dtype=np.int64)
+        else:
+            out = [0] * (hi - lo)
+            for src in (self, other):
+                off = src.lo - lo
+                for k, c in enumerate(src.counts):
+                    out[off + k] += c
+        return DenseHist(lo, out)
+
+Hist = Union[DenseHist, Counter]
+
+def hist_merge(acc: Optional[Hist], h: Hist) -> Hist:
+    """Funde h em acc (acc pode ser reaproveitado). Denso+denso → denso; senão → Counter."""
+    if acc is None or not acc:
+        return h
+    if not h:
+        return acc
+    if isinstance(acc, DenseHist):
+        if isinstance(h, DenseHist):
+            return acc.merge(h)
+        acc = acc.to_counter()
+    acc.update(dict(h.items()) if isinstance(h, DenseHist) else h)
+    return acc
+
+def hist_copy(h: Hist) -> Hist:
+    if isinstance(h, DenseHist):
+        return DenseHist(h.lo, h.counts.copy())
+    return Counter(h)
+
+def hist_total(h: Hist) -> int:
+    return h.total() if isinstance(h, DenseHist) else sum(h.values())
+
 # -------------------------
 # Particionamento por blocos (alinhado em '\n')
 # -------------------------
-def compute_spans(mm: mmap.mmap, parts: int) -> List[Tuple[int, int]]:
+def compute_spans(mm: mmap.mmap, parts: int, start: int = 0) -> List[Tuple[int, int]]:
     n = len(mm)
-    if parts <= 1 or n == 0:
-        return [(0, n)]
-    chunk = n // parts
-    starts = [0]
+    if start >= n:
+        return []
+    if parts <= 1:
+        return [(start, n)]
+    chunk = (n - start) // parts
+    starts = [start]
     for i in range(1, parts):
-        s = i * chunk
+        s = start + i * chunk
         if s >= n:
             s = n
         else:
@@ -43,15 +163,34 @@ def compute_spans(mm: mmap.mmap, parts: int) -> List[Tuple[int, int]]:
     spans = [(a,b) for (a,b) in spans if b > a]
     return spans
 
+def compute_chunks(mm: mmap.mmap, chunk_size: int, start: int = 0) -> List[Tuple[int, int]]:
+    # muitos pedaços de ~chunk_size bytes (alinhados em '\n'), independentes de P
+    n = len(mm)
+    spans = []
+    a = start
+    while a < n:
+        b = a + chunk_size
+        if b >= n:
+            b = n
+        else:
+            j = mm.find(b"\n", b - 1, n)
+            b = n if j == -1 else j + 1
+        spans.append((a, b))
+        a = b
+    return spans
+
 # -------------------------
 # Map local de cada thread
 # -------------------------
-def worker(mm: mmap.mmap, span: Tuple[int,int], out_list: List[Any], idx: int):
+def parse_span(mm: mmap.mmap, span: Tuple[int,int], hist: str = "dense") -> Tuple[int, Hist, int]:
     a, b = span
     pos = a
     local_sum = 0
     local_cnt = Counter()
     processed = 0
+    # modo denso: counts[val - lo]; vira Counter se a faixa passar de HIST_MAX_RANGE
+    dense = hist == "dense"
+    lo, counts, size = 0, [], 0
     # varre linhas dentro de [a,b)
     while pos < b:
         nl = mm.find(b"\n", pos, b)
@@ -73,71 +212,602 @@ def worker(mm: mmap.mmap, span: Tuple[int,int], out_list: List[Any], idx: int):
             # linha inválida; ignore ou trate conforme necessário
             continue
         local_sum += val
-        local_cnt[val] += 1
         processed += 1
-    out_list[idx] = (local_sum, local_cnt, processed)
+        if dense:
+            k = val - lo
+            if 0 <= k < size:
+                counts[k] += 1
+                continue
+            # fora da faixa atual: cresce (com folga) ou desiste do modo denso
+            if size == 0:
+                new_lo, new_hi = val, val + 1
+            else:
+                new_lo, new_hi = min(lo, val), max(lo + size, val + 1)
+            if new_hi - new_lo > HIST_MAX_RANGE:
+                dense = False
+                local_cnt.update(dict(DenseHist(lo, counts).items()))
+                local_cnt[val] += 1
+                continue
+            slack = min(max(size, 16), HIST_MAX_RANGE - (new_hi - new_lo))
+            if size and val < lo:
+                new_lo -= slack
+            else:
+                new_hi += slack
+            if size == 0:
+                counts = [0] * (new_hi - new_lo)
+            else:
+                counts = [0] * (lo - new_lo) + counts + [0] * (new_hi - lo - size)
+            lo, size = new_lo, new_hi - new_lo
+            counts[val - lo] += 1
+        else:
+            local_cnt[val] += 1
+    if dense:
+        return local_sum, DenseHist(lo, counts), processed
+    return local_sum, local_cnt, processed
+
+# -------------------------
+# Engine vetorizada (NumPy): parse em bloco de um span inteiro
+# -------------------------
+NP_BLOCK = 8 << 20     # sub-bloco por iteração (limita a memória temporária por worker)
+NP_MAX_DIGITS = 18     # até 18 dígitos cabem em int64 sem overflow
+if np is not None:
+    # bytes removidos por bytes.strip(): \t \n \v \f \r e espaço
+    _WS_LUT = np.zeros(256, dtype=bool)
+    _WS_LUT[[9, 10, 11, 12, 13, 32]] = True
+    _POW10 = 10 ** np.arange(NP_MAX_DIGITS + 1, dtype=np.int64)  # 10^18 ainda cabe em int64
+
+def _parse_block_numpy(data: bytes, hist: str = "dense") -> Tuple[int, Hist, int]:
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if len(buf) == 0:
+        return 0, Counter(), 0
+    if buf[-1] != 10:
+        buf = np.append(buf, np.uint8(10))
+    n = len(buf)
+    ends = np.flatnonzero(buf == 10)                   # cada linha termina no seu '\n'
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+
+    # conteúdo de cada linha após strip(): [first, last]
+    is_ws = _WS_LUT[buf]
+    if np.count_nonzero(is_ws) == len(ends):
+        # caso comum: só '\n' como espaço → sem reduceat por byte
+        first, last = starts, ends - 1
+    else:
+        pos = np.arange(n, dtype=np.int64)
+        first = np.minimum.reduceat(np.where(is_ws, n, pos), starts)
+        last = np.maximum.reduceat(np.where(is_ws, -1, pos), starts)
+    length = last - first + 1                          # <= 0 → linha vazia (ignorada)
+
+    # Linhas "simples" ([sinal]dígitos) são convertidas em lote, agrupadas por
+    # comprimento: matriz (linhas x k) de dígitos · potências de 10.
+    # Todo o resto (ex.: '1_000', lixo, números enormes) vai para int() em Python,
+    # que decide exatamente como a engine python.
+    parts = []
+    fallback = [np.flatnonzero(length > NP_MAX_DIGITS + 1)]
+    for k in np.unique(length[(length > 0) & (length <= NP_MAX_DIGITS + 1)]).tolist():
+        sel = np.flatnonzero(length == k)
+        M = buf[first[sel, None] + np.arange(k)]
+        is_digit = (M >= 48) & (M <= 57)
+        head = M[:, 0]
+        signed = (head == 43) | (head == 45)
+        ok = is_digit[:, 1:].all(axis=1) & (is_digit[:, 0] | (signed & (k > 1)))
+        if k == NP_MAX_DIGITS + 1:
+            ok &= signed                               # 19 dígitos sem sinal podem estourar int64
+        fallback.append(sel[~ok])
+        M, signed, head = M[ok], signed[ok], head[ok]
+        d = M.astype(np.int64) - 48
+        d[signed, 0] = 0
+        v = d @ _POW10[k - 1::-1]
+        parts.append(np.where(head == 45, -v, v))
+    vals = np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+    local_sum = 0
+    h: Hist = Counter()
+    if len(vals):
+        vmin, vmax = int(vals.min()), int(vals.max())
+        # np.sum em int64 só quando não há risco de overflow
+        if max(abs(vmin), abs(vmax)) * len(vals) < (1 << 63):
+            local_sum = int(np.sum(vals))
+        else:
+            local_sum = sum(vals.tolist())
+        if hist == "dense" and vmax - vmin < HIST_MAX_RANGE:
+            h = DenseHist(vmin, np.bincount(vals - vmin))
+        else:
+            keys, cnt = np.unique(vals, return_counts=True)
+            h = Counter(dict(zip(keys.tolist(), cnt.tolist())))
+    processed = len(vals)
+
+    extra = Counter()
+    for li in np.concatenate(fallback).tolist():
+        try:
+            val = int(data[starts[li]:ends[li]].strip())
+        except ValueError:
+            continue
+        local_sum += val
+        extra[val] += 1
+        processed += 1
+    if extra:
+        h = hist_merge(h, extra)
+    return local_sum, h, processed
+
+def parse_span_numpy(mm: mmap.mmap, span: Tuple[int,int], hist: str = "dense") -> Tuple[int, Hist, int]:
+    if np is None:
+        raise RuntimeError("--engine numpy requer o pacote numpy (pip install numpy)")
+    a, b = span
+    local_sum = 0
+    local_cnt: Optional[Hist] = None
+    processed = 0
+    # sub-blocos alinhados em '\n' para não materializar o span inteiro
+    pos = a
+    while pos < b:
+        end = min(pos + NP_BLOCK, b)
+        if end < b:
+            j = mm.find(b"\n", end, b)
+            end = b if j == -1 else j + 1
+        s, c, n = _parse_block_numpy(mm[pos:end], hist)
+        local_sum += s
+        local_cnt = hist_merge(local_cnt, c)
+        processed += n
+        pos = end
+    return local_sum, (Counter() if local_cnt is None else local_cnt), processed
+
+ENGINES = {"python": parse_span, "numpy": parse_span_numpy}
+
+def worker(mm: mmap.mmap, span: Tuple[int,int], out_list: List[Any], idx: int,
+           engine: str = "python", hist: str = "dense", stats: Optional[List[Any]] = None):
+    t0 = time.perf_counter()
+    out_list[idx] = ENGINES[engine](mm, span, hist)
+    if stats is not None:
+        stats[idx] = (time.perf_counter() - t0, 1)  # (tempo ocupado, nº de tarefas)
+
+def dynamic_worker(mm: mmap.mmap, spans: List[Tuple[int,int]], pending: "queue.Queue[int]",
+                   out_list: List[Any], wid: int, engine: str, hist: str, stats: List[Any]):
+    # puxa o próximo chunk da fila compartilhada até esvaziá-la: quem termina
+    # cedo pega mais trabalho, em vez de esperar o span mais lento
+    busy = 0.0
+    tasks = 0
+    while True:
+        try:
+            i = pending.get_nowait()
+        except queue.Empty:
+            break
+        t0 = time.perf_counter()
+        out_list[i] = ENGINES[engine](mm, spans[i], hist)
+        busy += time.perf_counter() - t0
+        tasks += 1
+    stats[wid] = (busy, tasks)
+
+# -------------------------
+# Map em processo separado (fora do GIL)
+# -------------------------
+def process_worker(path: str, span: Tuple[int,int], engine: str = "python",
+                   hist: str = "dense") -> Tuple[Tuple[int, Hist, int], int, float]:
+    # cada processo abre o próprio mmap do arquivo: nada de bytes trafega entre
+    # processos na ida, e na volta só o parcial compacto (soma, hist, contagem)
+    # + (pid, tempo ocupado) para o relatório de balanceamento
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        t0 = time.perf_counter()
+        res = ENGINES[engine](mm, span, hist)
+        return res, os.getpid(), time.perf_counter() - t0
 
 # -------------------------
 # Reduce na thread principal
 # -------------------------
-def reduce_results(results: List[Tuple[int, Counter, int]]):
+def reduce_results(results: List[Tuple[int, Hist, int]]):
     total_sum = 0
-    total_hist = Counter()
+    total_hist: Optional[Hist] = None
     total_n = 0
     for s, c, n in results:
         total_sum += s
-        total_hist.update(c)
+        if not total_hist:
+            # cópia: o acumulador é alterado in-place e os parciais podem ainda ir para o cache
+            total_hist = hist_copy(c)
+        else:
+            total_hist = hist_merge(total_hist, c)  # denso: soma vetorial; esparso: Counter.update
         total_n += n
+    if total_hist is None:
+        total_hist = Counter()
     # consistência interna: |hist| somatório == contagem total
-    assert sum(total_hist.values()) == total_n, "Reduce inconsistente: hist vs contagem"
+    assert hist_total(total_hist) == total_n, "Reduce inconsistente: hist vs contagem"
     return total_sum, total_hist, total_n
 
 # -------------------------
-# Execução com P threads
+# Execução com P threads (ou P processos)
 # -------------------------
-def run_once(path: str, P: int):
-    size = os.path.getsize(path)
-    if size == 0:
-        return 0, Counter(), 0, 0.0
+BACKENDS = ("thread", "process")
 
-    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
-        spans = compute_spans(mm, P)
-        # out_list tem 1 slot por thread (um único escritor por slot → sem mutex)
-        out_list: List[Any] = [None] * len(spans)
+def map_spans(path: str, mm: mmap.mmap, spans: List[Tuple[int,int]], backend: str = "thread",
+              engine: str = "python", hist: str = "dense", workers: Optional[int] = None,
+              stats: Optional[List[Any]] = None) -> List[Any]:
+    """
+    Aplica a engine a cada span; devolve 1 parcial por span (um único escritor por slot → sem mutex).
+    workers=None: 1 worker por span (particionamento estático).
+    workers=P: P workers puxando spans de uma fila compartilhada (use com compute_chunks).
+    stats (opcional) recebe, por worker, (tempo ocupado em s, nº de tarefas).
+    """
+    out_list: List[Any] = [None] * len(spans)
+    if not spans:
+        return out_list
+    if backend == "process":
+        # o tempo inclui subir o pool: é o custo real que o usuário paga.
+        # O executor já distribui tarefas dinamicamente para processos ociosos.
+        per_pid: Dict[int, List[float]] = {}
+        with ProcessPoolExecutor(max_workers=workers or len(spans)) as ex:
+            futs = [ex.submit(process_worker, path, sp, engine, hist) for sp in spans]
+            for i, fu in enumerate(futs):
+                out_list[i], pid, busy = fu.result()
+                acc = per_pid.setdefault(pid, [0.0, 0])
+                acc[0] += busy
+                acc[1] += 1
+        if stats is not None:
+            stats.extend(tuple(v) for v in per_pid.values())
+    elif workers is None:
+        local_stats: List[Any] = [None] * len(spans)
         threads: List[th.Thread] = []
-
-        t0 = time.perf_counter()
         for i, sp in enumerate(spans):
-            t = th.Thread(target=worker, args=(mm, sp, out_list, i), daemon=False)
+            t = th.Thread(target=worker, args=(mm, sp, out_list, i, engine, hist, local_stats), daemon=False)
+            threads.append(t)
+            t.start()
+        for t in threads:
+            t.join()
+        if stats is not None:
+            stats.extend(local_stats)
+    else:
+        pending: "queue.Queue[int]" = queue.Queue()
+        for i in range(len(spans)):
+            pending.put(i)
+        local_stats = [None] * workers
+        threads = []
+        for w in range(workers):
+            t = th.Thread(target=dynamic_worker,
+                          args=(mm, spans, pending, out_list, w, engine, hist, local_stats), daemon=False)
             threads.append(t)
             t.start()
         for t in threads:
             t.join()
+        if stats is not None:
+            stats.extend(local_stats)
+    return out_list
+
+def balance_summary(stats: List[Tuple[float, int]], elapsed: float) -> Dict[str, float]:
+    """Ocupado/ocioso por worker: ocioso = elapsed - ocupado; imbalance = max/média do ocupado."""
+    if not stats:
+        return {"busy_max_s": 0.0, "busy_mean_s": 0.0, "idle_mean_s": 0.0, "imbalance": 0.0}
+    busy = [b for b, _ in stats]
+    mean = sum(busy) / len(busy)
+    return {
+        "busy_max_s": max(busy),
+        "busy_mean_s": mean,
+        "idle_mean_s": sum(max(0.0, elapsed - b) for b in busy) / len(busy),
+        "imbalance": max(busy) / mean if mean > 0 else 0.0,
+    }
+
+def plan_spans(mm: mmap.mmap, P: int, chunk_size: int = 0, start: int = 0):
+    """(spans, workers) para map_spans: P spans estáticos ou chunks dinâmicos."""
+    if chunk_size > 0:
+        return compute_chunks(mm, chunk_size, start), P
+    return compute_spans(mm, P, start), None
+
+def run_once(path: str, P: int, backend: str = "thread", engine: str = "python", hist: str = "dense",
+             chunk_size: int = 0, stats: Optional[List[Any]] = None):
+    size = os.path.getsize(path)
+    if size == 0:
+        return 0, Counter(), 0, 0.0
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        spans, workers = plan_spans(mm, P, chunk_size)
+        t0 = time.perf_counter()
+        out_list = map_spans(path, mm, spans, backend, engine, hist, workers, stats)
         elapsed = time.perf_counter() - t0
 
         total_sum, total_hist, total_n = reduce_results(out_list)  # reduce único, sem locks
         return total_sum, total_hist, total_n, elapsed
 
+# -------------------------
+# Cache persistente de parciais (arquivo "sidecar" ao lado da entrada)
+# -------------------------
+CACHE_SUFFIX = ".ex06cache"
+CACHE_VERSION = 2
+CACHE_MAX_SPANS = 64   # acima disso, os spans antigos são fundidos num só
+CACHE_HASH_BLOCK = 1 << 20  # bytes por update() ao calcular o digest de um span
+
+def file_identity(path: str) -> Dict[str, int]:
+    st = os.stat(path)
+    return {"dev": st.st_dev, "ino": st.st_ino, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def span_digest(mm: mmap.mmap, start: int, end: int) -> str:
+    # digest do span inteiro: hashear é bem mais barato que parsear, e pega edição em qualquer ponto
+    h = hashlib.blake2b(digest_size=16)
+    for a in range(start, end, CACHE_HASH_BLOCK):
+        h.update(mm[a:min(end, a + CACHE_HASH_BLOCK)])
+    return h.hexdigest()
+
+def hist_to_json(h: Hist) -> Dict[str, Any]:
+    if isinstance(h, DenseHist):
+        return {"lo": h.lo, "counts": [int(c) for c in h.counts]}
+    return {"items": [[k, v] for k, v in h.items() if v]}
+
+def hist_from_json(d: Dict[str, Any]) -> Hist:
+    if "counts" in d:
+        return DenseHist(d["lo"], d["counts"])
+    return Counter({k: v for k, v in d["items"]})
+
+def load_cache(path: str, mm: mmap.mmap) -> List[Dict[str, Any]]:
+    """
+    Spans cacheados ainda válidos para o arquivo atual ([] = cache ausente/inválido).
+    Mesmo tamanho e mesmo mtime: reaproveita tudo. Mesmo tamanho e mtime novo:
+    reescrita no lugar, descarta. Arquivo maior (append): confere o digest de
+    cada span e fica só com os que batem, até o primeiro que não bate.
+    """
+    try:
+        with open(path + CACHE_SUFFIX, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return []
+    ident = file_identity(path)
+    try:
+        end = cache.get("end", 0)
+        if (cache.get("version") != CACHE_VERSION
+                or cache["dev"] != ident["dev"] or cache["ino"] != ident["ino"]   # outro arquivo (rename/rewrite)
+                or end > ident["size"]                                            # truncado
+                or (end == ident["size"] and cache["mtime_ns"] != ident["mtime_ns"])):  # reescrito no lugar
+            return []
+        spans = cache["spans"]
+        for e in spans:
+            e["start"], e["end"], e["sum"], e["n"], e["hist"], e["digest"]
+        if end == ident["size"]:
+            return spans
+        valid = []
+        for e in spans:
+            if span_digest(mm, e["start"], e["end"]) != e["digest"]:
+                break  # editado: daqui em diante é reparseado
+            valid.append(e)
+        return valid
+    except (KeyError, TypeError, AttributeError):
+        return []  # sidecar malformado conta como cache inválido
+
+def save_cache(path: str, mm: mmap.mmap, spans: List[Dict[str, Any]]) -> None:
+    if len(spans) > CACHE_MAX_SPANS:
+        s, h, n = reduce_results([(e["sum"], hist_from_json(e["hist"]), e["n"]) for e in spans])
+        a, b = spans[0]["start"], spans[-1]["end"]
+        spans = [{"start": a, "end": b, "sum": s, "n": n, "hist": hist_to_json(h), "digest": span_digest(mm, a, b)}]
+    end = spans[-1]["end"] if spans else 0
+    cache = dict(version=CACHE_VERSION, **file_identity(path), end=end, spans=spans)
+    tmp = path + CACHE_SUFFIX + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cache, f)
+    os.replace(tmp, path + CACHE_SUFFIX)  # troca atômica: nunca deixa cache pela metade
+
+def run_cached(path: str, P: int, backend: str = "thread", engine: str = "python", hist: str = "dense",
+               chunk_size: int = 0, stats: Optional[List[Any]] = None):
+    """
+    Como run_once, mas reaproveita os parciais do cache e só parseia [fim_cacheado, size).
+    Só spans terminados em '\n' vão para o cache (a última linha pode ainda estar sendo escrita).
+    Retorna (soma, hist, n, elapsed, bytes_reaproveitados, bytes_parseados).
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return 0, Counter(), 0, 0.0, 0, 0
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        t0 = time.perf_counter()
+        cached = load_cache(path, mm)
+        start = cached[-1]["end"] if cached else 0
+        spans, workers = plan_spans(mm, P, chunk_size, start)
+        out_list = map_spans(path, mm, spans, backend, engine, hist, workers, stats)
+        # serializa antes do reduce: o cache guarda só o parcial de cada span
+        new_entries = [{"start": a, "end": b, "sum": ps, "n": pn, "hist": hist_to_json(ph),
+                        "digest": span_digest(mm, a, b)}
+                       for (a, b), (ps, ph, pn) in zip(spans, out_list)
+                       if mm[b-1:b] == b"\n"]
+        partials = [(e["sum"], hist_from_json(e["hist"]), e["n"]) for e in cached] + out_list
+        total_sum, total_hist, total_n = reduce_results(partials)
+        elapsed = time.perf_counter() - t0
+
+        # um span sem '\n' final só pode ser o último; ele é reparseado na próxima vez
+        if new_entries or not cached:
+            save_cache(path, mm, cached + new_entries)
+        return total_sum, total_hist, total_n, elapsed, start, size - start
+
+# -------------------------
+# Modo streaming: blocos de tamanho fixo → fila limitada → P workers
+# -------------------------
+STREAM_BLOCK = 1 << 20  # bytes lidos por read()
+COMPRESSED = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+def open_input(path: str):
+    if path == "-":
+        # pipe não tem extensão: detecta gzip pelo magic number
+        if sys.stdin.buffer.peek(2)[:2] == b"\x1f\x8b":
+            return gzip.GzipFile(fileobj=sys.stdin.buffer, mode="rb")
+        return sys.stdin.buffer
+    opener = COMPRESSED.get(os.path.splitext(path)[1].lower())
+    return opener(path, "rb") if opener else open(path, "rb", buffering=0)
+
+def is_mappable(path: str) -> bool:
+    return path != "-" and os.path.splitext(path)[1].lower() not in COMPRESSED
+
+def iter_blocks(f, block_size: int):
+    """Lê blocos de block_size bytes e devolve pedaços terminando em '\n'.
+    A linha parcial no fim de cada leitura é carregada para o bloco seguinte."""
+    carry = b""
+    while True:
+        data = f.read(block_size)
+        if not data:
+            break
+        if carry:
+            data = carry + data
+        j = data.rfind(b"\n")
+        if j == -1:
+            carry = data  # linha maior que o bloco: continua acumulando
+            continue
+        carry = data[j+1:]
+        yield data[:j+1]
+    if carry:
+        yield carry
+
+def parse_block(block: bytes, engine: str = "python", hist: str = "dense") -> Tuple[int, Hist, int]:
+    # bytes expõe find()/fatias como o mmap → as engines servem aos dois modos
+    return ENGINES[engine](block, (0, len(block)), hist)
+
+def stream_process_block(block: bytes, engine: str, hist: str):
+    # parcial + (pid, tempo ocupado), como process_worker no caminho mmap
+    t0 = time.perf_counter()
+    res = parse_block(block, engine, hist)
+    return res, os.getpid(), time.perf_counter() - t0
+
+def stream_worker(q: "queue.Queue[Optional[bytes]]", out_list: List[Any], idx: int,
+                  engine: str, hist: str, stats: List[Any]):
+    acc_sum, acc_hist, acc_n = 0, None, 0
+    busy, tasks = 0.0, 0
+    while True:
+        block = q.get()
+        if block is None:  # sentinela: fim do arquivo
+            break
+        t0 = time.perf_counter()
+        s, c, n = parse_block(block, engine, hist)
+        acc_sum += s
+        acc_hist = hist_merge(acc_hist, c)
+        acc_n += n
+        busy += time.perf_counter() - t0
+        tasks += 1
+    out_list[idx] = (acc_sum, Counter() if acc_hist is None else acc_hist, acc_n)
+    stats[idx] = (busy, tasks)
+
+def run_stream(path: str, P: int, backend: str = "thread", engine: str = "python",
+               hist: str = "dense", block_size: int = STREAM_BLOCK, stats: Optional[List[Any]] = None):
+    """
+    Igual a run_once, mas sem mmap: o leitor (thread principal) lê blocos e os
+    entrega a P workers por uma fila de 2P posições. Memória ~ (2P + P) blocos,
+    e a leitura do próximo bloco sobrepõe o parse dos anteriores.
+    """
+    inflight = 2 * P
+    f = open_input(path)
+    try:
+        t0 = time.perf_counter()
+        if backend == "process":
+            out_list: List[Any] = []
+            per_pid: Dict[int, List[float]] = {}
+
+            def collect(futs):
+                parts = []
+                for fu in futs:
+                    res, pid, busy = fu.result()
+                    acc = per_pid.setdefault(pid, [0.0, 0])
+                    acc[0] += busy
+                    acc[1] += 1
+                    parts.append(res)
+                return parts
+
+            with ProcessPoolExecutor(max_workers=P) as ex:
+                pending = set()
+                for block in iter_blocks(f, block_size):
+                    if len(pending) >= inflight:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        out_list.append(reduce_results(collect(done)))
+                    pending.add(ex.submit(stream_process_block, block, engine, hist))
+                out_list.extend(collect(pending))
+            if stats is not None:
+                stats.extend(tuple(v) for v in per_pid.values())
+        else:
+            q: "queue.Queue[Optional[bytes]]" = queue.Queue(maxsize=inflight)
+            out_list = [None] * P
+            local_stats: List[Any] = [None] * P
+            threads: List[th.Thread] = []
+            for i in range(P):
+                t = th.Thread(target=stream_worker, args=(q, out_list, i, engine, hist, local_stats), daemon=False)
+                threads.append(t)
+                t.start()
+            for block in iter_blocks(f, block_size):
+                q.put(block)  # bloqueia se os workers estão atrás (backpressure)
+            for _ in threads:
+                q.put(None)
+            for t in threads:
+                t.join()
+            if stats is not None:
+                stats.extend(local_stats)
+        elapsed = time.perf_counter() - t0
+    finally:
+        if f is not sys.stdin.buffer:
+            f.close()
+
+    total_sum, total_hist, total_n = reduce_results(out_list)
+    return total_sum, total_hist, total_n, elapsed
+
 # -------------------------
 # Main / CLI
 # -------------------------
 def main():
     ap = argparse.ArgumentParser(description="Soma e histograma paralelos (threads) para arquivo grande de inteiros (1 por linha).")
-    ap.add_argument("file", help="Arquivo de entrada (inteiros por linha)")
+    ap.add_argument("file", help="Arquivo de entrada (inteiros por linha); '-' = stdin (requer --stream)")
     ap.add_argument("-p", "--threads", type=int, default=4, help="Número de threads (P)")
     ap.add_argument("--sweep", action="store_true", help="Mede speedup para P=1,2,4,8 e valida corretude vs P=1")
     ap.add_argument("--print-top", type=int, default=0, help="Imprime os K valores mais frequentes do histograma")
+    ap.add_argument("--backend", choices=BACKENDS, default="thread",
+                    help="thread: threads sobre o mesmo mmap | process: 1 processo por span (sem GIL)")
+    ap.add_argument("--engine", choices=list(ENGINES) + ["all"], default="python",
+                    help="python: int() por linha | numpy: parse vetorizado em bloco | all: compara as engines (só com --sweep)")
+    ap.add_argument("--hist", choices=HIST_MODES, default="dense",
+                    help=f"dense: contagens em array (vira Counter se a faixa passar de {HIST_MAX_RANGE}) | sparse: Counter")
+    ap.add_argument("--stream", action="store_true",
+                    help="Lê em blocos com fila limitada (stdin, .gz/.bz2/.xz, arquivos enormes) em vez de mmap")
+    ap.add_argument("--block-kb", type=int, default=STREAM_BLOCK >> 10, help="Tamanho do bloco no modo --stream (KiB)")
+    ap.add_argument("--cache", action="store_true",
+                    help=f"Guarda parciais por span em <arquivo>{CACHE_SUFFIX} e, na próxima execução, só parseia o que foi anexado "
+                         "(spans reaproveitados são conferidos por digest)")
+    ap.add_argument("--chunk-kb", type=int, default=0,
+                    help="0: P spans iguais (estático) | N>0: chunks de ~N KiB puxados dinamicamente por P workers")
     args = ap.parse_args()
 
-    if not os.path.exists(args.file):
+    if args.file == "-":
+        if not args.stream:
+            raise SystemExit("stdin ('-') só é suportado com --stream")
+        if args.sweep:
+            raise SystemExit("--sweep relê a entrada várias vezes; não funciona com stdin")
+    elif not os.path.exists(args.file):
         raise SystemExit(f"Arquivo não encontrado: {args.file}")
+    if not args.stream and not is_mappable(args.file):
+        raise SystemExit("Arquivo comprimido: use --stream")
+
+    if args.cache and (args.stream or args.sweep):
+        raise SystemExit("--cache só vale para a execução única sobre mmap (sem --stream/--sweep)")
+
+    block_size = max(1, args.block_kb) << 10
+    chunk_size = max(0, args.chunk_kb) << 10
+    def run(P: int, engine: str, stats: List[Any]):
+        if args.stream:
+            return run_stream(args.file, P, args.backend, engine, args.hist, block_size, stats)
+        return run_once(args.file, P, args.backend, engine, args.hist, chunk_size, stats)
+
+    if args.engine == "numpy" or args.engine == "all":
+        if np is None:
+            raise SystemExit("--engine numpy requer o pacote numpy (pip install numpy)")
 
     if not args.sweep:
-        total_sum, hist, total_n, t = run_once(args.file, max(1, args.threads))
-        print(f"Arquivo: {args.file} | P={args.threads}")
+        if args.engine == "all":
+            raise SystemExit("--engine all só faz sentido com --sweep")
+        stats: List[Any] = []
+        if args.cache:
+            total_sum, hist, total_n, t, reused, parsed = run_cached(args.file, max(1, args.threads),
+                                                                     args.backend, args.engine, args.hist,
+                                                                     chunk_size, stats)
+        else:
+            total_sum, hist, total_n, t = run(max(1, args.threads), args.engine, stats)
+        print(f"Arquivo: {args.file} | P={args.threads} | backend={args.backend} | engine={args.engine} | hist={args.hist}"
+              + (f" | stream (bloco {args.block_kb} KiB)" if args.stream else "")
+              + (f" | chunks de {args.chunk_kb} KiB" if chunk_size and not args.stream else ""))
+        if args.cache:
+            print(f"Cache: {reused} bytes reaproveitados | {parsed} bytes parseados")
         print(f"Linhas (válidas): {total_n}")
         print(f"Soma total: {total_sum}")
         print(f"Tempo: {human_time(t)}")
+        if stats:
+            print("Workers (ocupado / ocioso / tarefas):")
+            for i, (busy, tasks) in enumerate(stats):
+                print(f"  w{i}: {human_time(busy)} / {human_time(max(0.0, t - busy))} / {tasks}")
+            bal = balance_summary(stats, t)
+            print(f"  desbalanceamento (max/média ocupado): {bal['imbalance']:.2f}")
         if args.print_top > 0 and hist:
             topk = hist.most_common(args.print_top)
             print(f"Top {args.print_top} frequências:")
@@ -145,33 +815,44 @@ def main():
                 print(f"  {val}: {cnt}")
         return
 
-    # Sweep P = 1,2,4,8 com validação
+    # Sweep P = 1,2,4,8 com validação (por engine; todas validadas contra a 1ª engine com P=1)
     Ps = [1, 2, 4, 8]
+    engines = list(ENGINES) if args.engine == "all" else [args.engine]
     baseline_sum = None
     baseline_hist = None
     baseline_n = None
+    if args.stream and is_mappable(args.file):
+        # no streaming, a referência de corretude é o caminho mmap (P=1)
+        baseline_sum, baseline_hist, baseline_n, _ = run_once(args.file, 1, "thread", engines[0], args.hist)
     times = {}
-    print("P,lines,sum,time_s,speedup_vs_P1")
-    for P in Ps:
-        total_sum, hist, total_n, t = run_once(args.file, P)
-        times[P] = t
-        if P == 1:
-            baseline_sum = total_sum
-            baseline_hist = hist
-            baseline_n = total_n
-            speedup = 1.0
-        else:
-            # Prova de corretude: resultados devem coincidir com P=1
-            assert total_sum == baseline_sum, f"Soma difere vs P=1 (P={P})"
-            assert hist == baseline_hist, f"Histograma difere vs P=1 (P={P})"
-            assert total_n == baseline_n, f"Contagem difere vs P=1 (P={P})"
-            speedup = times[1] / t if t > 0 else 0.0
-        print(f"{P},{total_n},{total_sum},{t:.6f},{speedup:.3f}")
-
-    print("\nResumo:")
-    for P in Ps:
-        sp = times[1] / times[P] if times[P] > 0 else 0.0
-        print(f"  P={P}: {human_time(times[P])}  | speedup ≈ {sp:.2f}x")
+    print("P,lines,sum,time_s,speedup_vs_P1,engine,workers,tasks,busy_max_s,busy_mean_s,idle_mean_s,imbalance")
+    for eng in engines:
+        for P in Ps:
+            stats = []
+            total_sum, hist, total_n, t = run(P, eng, stats)
+            bal = balance_summary(stats, t)
+            times[(eng, P)] = t
+            if baseline_n is None:
+                baseline_sum = total_sum
+                baseline_hist = hist
+                baseline_n = total_n
+            else:
+                # Prova de corretude: resultados devem coincidir com a referência (P=1)
+                assert total_sum == baseline_sum, f"Soma difere vs P=1 (P={P}, engine={eng})"
+                assert hist == baseline_hist, f"Histograma difere vs P=1 (P={P}, engine={eng})"
+                assert total_n == baseline_n, f"Contagem difere vs P=1 (P={P}, engine={eng})"
+            t1 = times[(engines[0], 1)]
+            speedup = t1 / t if t > 0 else 0.0
+            print(f"{P},{total_n},{total_sum},{t:.6f},{speedup:.3f},{eng},"
+                  f"{len(stats)},{sum(k for _, k in stats)},{bal['busy_max_s']:.6f},{bal['busy_mean_s']:.6f},"
+                  f"{bal['idle_mean_s']:.6f},{bal['imbalance']:.3f}")
+
+    print(f"\nResumo (backend={args.backend}{', stream' if args.stream else ''}, speedup vs {engines[0]} P=1):")
+    t1 = times[(engines[0], 1)]
+    for eng in engines:
+        for P in Ps:
+            sp = t1 / times[(eng, P)] if times[(eng, P)] > 0 else 0.0
+            print(f"  {eng:>6} P={P}: {human_time(times[(eng, P)])}  | speedup ≈ {sp:.2f}x")
 
 if __name__ == "__main__":
     main()